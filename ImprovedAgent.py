@@ -1,40 +1,55 @@
 import os
 import random
+import numpy as np
 import chess
 import chess.engine
 from reconchess import Player
 from reconchess.utilities import without_opponent_pieces, is_illegal_castle
-from collections import Counter, defaultdict
-
-_WINDOW_CACHE = {}
-def _window(center):
-    if center in _WINDOW_CACHE:
-        return _WINDOW_CACHE[center]
-    f, r = chess.square_file(center), chess.square_rank(center)
-    _WINDOW_CACHE[center] = [
-        chess.square(x, y)
-        for x in range(f - 1, f + 2)
-        for y in range(r - 1, r + 2)
-        if 0 <= x < 8 and 0 <= y < 8
-    ]
-    return _WINDOW_CACHE[center]
-
-def _sense_outcome(board, window):
-    return tuple(
-        (sq, board.piece_at(sq).symbol() if board.piece_at(sq) else None)
-        for sq in window
-    )
+from collections import Counter
+from beliefs import BeliefStore, ParticleBudget, PendingExpansion, LAZY_EXPANSION, window_squares, interior_squares
+from enginepool import EngineCache, STOCKFISH_PATH, POOL_SIZE, MULTIPV, choose_by_expected_score
+from engineservice import open_engine
+from timebudget import TimeBudget, MIN_SEARCH_TIME, MIN_MULTIPV_TIME
+from tactics import decisive_king_capture
+from openings import OpeningBook, BOOK_PATH
+from expansionpool import ExpansionPool
+from memorybudget import MemoryGovernor
+
+#rough cost of scoring sense windows, per belief
+SENSE_SECONDS_PER_BOARD = 2e-5
+#children expanded to plan the sense on while the expansion waits for the sense result
+PREVIEW_BOARDS = 300
 
 class ImprovedAgent(Player):
     def __init__(self):
         self.board = None
         self.color = None
-        self.possible_boards = []
-        self.board_confidence = defaultdict(lambda: 1)
+        self.possible_boards = BeliefStore()
         self.last_capture_sq = None
         #self.stockfish_path = './stockfish.exe'
-        self.stockfish_path= chess.engine.SimpleEngine.popen_uci('/opt/stockfish/stockfish', setpgrp=True)
-        self.engine = chess.engine.SimpleEngine.popen_uci(self.stockfish_path, setpgrp=True)
+        self.stockfish_path = STOCKFISH_PATH
+        #one stockfish per core, boards are searched in parallel. results are cached
+        #by position since most beliefs carry over from one turn to the next.
+        #with RBC_ENGINE_SERVICE set the engines are the shared service's instead
+        self.engine_cache = EngineCache()
+        self.engine = open_engine(POOL_SIZE, self.stockfish_path, cache=self.engine_cache)
+        self.clock = TimeBudget()
+        #beliefs are weighted particles, their number is set by memory and time rather than a constant
+        self.particles = ParticleBudget()
+        #expand the opponent's move only once the sense result is known
+        self.lazy_expansion = LAZY_EXPANSION
+        #worker processes sharing large expansions, RBC_EXPANSION_WORKERS of them
+        self.expansion = ExpansionPool()
+        #resizes the particle budget each turn from the memory actually free
+        self.memory = MemoryGovernor(self.particles, processes=self.expansion.workers)
+        #set by harness.py when this instance plays many games, the engines then stay warm
+        self.keep_engine = False
+        #score every candidate move on every board and play the best weighted mean,
+        #rather than voting with each board's best move
+        self.multipv = MULTIPV
+        #precomputed beliefs and sense squares for the opening line, None when not built
+        self.book = OpeningBook.load(BOOK_PATH)
+        self.book_cursor = None
 
         #opening strategy
         self.current_move = 0
@@ -57,77 +72,78 @@ class ImprovedAgent(Player):
     def handle_game_start(self, color, board, opponent_name):
         self.color = color
         self.board = board
-        self.possible_boards = [board.fen()]
+        self.possible_boards = BeliefStore([board])
+        self.clock = TimeBudget()
         self.last_capture_sq = None
         self.current_move = 0
         self.perform_opening = True
+        self.book_cursor = self.book.cursor(color) if self.book is not None else None
 
     def handle_opponent_move_result(self, captured_my_piece, capture_square):
+        self.clock.start_turn()
         self.last_capture_sq = capture_square if captured_my_piece else None
-        new_boards = set()
-        for fen in self.possible_boards:
-            b = chess.Board(fen)
-            b.clear_stack()
-            if b.turn != (not self.color):
-                continue
-            for mv in b.pseudo_legal_moves:
-                if captured_my_piece and mv.to_square != capture_square:
-                    continue
-                b.push(mv)
-                new_boards.add(b.fen())
-                b.pop()
-        if captured_my_piece:
-            self.possible_boards = random.sample(list(new_boards), min(1000, len(new_boards)))
-        else:
-            self.possible_boards = random.sample(self.possible_boards, min(1000, len(self.possible_boards)))
+        #while the game follows the book the beliefs are looked up, not expanded
+        if self.book_cursor is not None:
+            beliefs = self.book_cursor.opponent_moved(self.last_capture_sq)
+            if beliefs is not None:
+                self.possible_boards = beliefs
+                return
+        parents = self.possible_boards.with_turn(not self.color)
+        #white is told about black's "move" before black has played
+        if not len(parents):
+            return
+        #every opponent move is expanded, a quiet report drops children that took one of our pieces
+        self.memory.update()
+        limit = self.particles.capacity(self.clock.remaining('update'))
+        if self.lazy_expansion:
+            self.possible_boards = PendingExpansion(parents, self.last_capture_sq, limit, self.expansion,
+                                                    self.particles.slack)
+            return
+        self.possible_boards = self.expansion.expand(parents, self.last_capture_sq, limit=limit,
+                                                     deadline=self.clock.deadline('update'),
+                                                     slack=self.particles.slack)
 
     def choose_sense(self, sense_actions, move_actions, seconds_left):
-        sample = random.sample(self.possible_boards, min(300, len(self.possible_boards)))
-        king_heatmap = Counter()
-        for fen in sample:
-            b = chess.Board(fen)
-            b.clear_stack()
-            k = b.king(not self.color)
-            if k:
-                king_heatmap[k] += 1
+        self.clock.sync(seconds_left)
+        if self.book_cursor is not None and self.book_cursor.sense in sense_actions:
+            return self.book_cursor.sense
+        beliefs = self.possible_boards
+        if not len(beliefs):
+            return random.choice(sense_actions)
+        if isinstance(beliefs, PendingExpansion):
+            beliefs = beliefs.preview(PREVIEW_BOARDS)
+        #read off the occupancy table of every belief, not just the sample below
+        king_heatmap = beliefs.piece_probability(chess.KING, not self.color)
+        #plan on a sample when the sense share of the turn cannot cover every belief
+        beliefs = beliefs.sample(max(300, self.clock.affordable('sense', SENSE_SECONDS_PER_BOARD)))
+
+        #information gain over every belief, plus a bonus for windows likely to hold the enemy king
+        candidates = interior_squares(sense_actions) or sense_actions
+        gains = beliefs.sense_gains(candidates)
+        #gains are bits and the heatmap a probability. a window sure to hold the king is worth
+        #half the best window's gain, as it was when both terms counted boards of the sample. when
+        #no window tells the boards apart the bonus keeps a floor so the king is still looked for
+        king_bonus = 0.5 * max(max(gains.values(), default=0.0), 1.0)
 
         best_sq, best_score = None, -1
-        for sq in sense_actions:
-            seen = set()
-            proximity_score = sum(king_heatmap[s] for s in _window(sq))
-            for fen in sample:
-                b = chess.Board(fen)
-                b.clear_stack()
-                seen.add(_sense_outcome(b, _window(sq)))
-            entropy_score = len(seen)
-            total_score = entropy_score + 0.5 * proximity_score 
+        for sq in candidates:
+            proximity_score = sum(king_heatmap[s] for s in window_squares(sq))
+            total_score = gains[sq] + king_bonus * proximity_score
             if total_score > best_score:
                 best_sq, best_score = sq, total_score
         return best_sq
 
     def handle_sense_result(self, sense_result):
-        def consistent(board):
-            for sq, expected in sense_result:
-                actual = board.piece_at(sq)
-                if (actual is None) != (expected is None):
-                    return False
-                if actual and actual.symbol() != expected:
-                    return False
-            return True
-
-        new_boards = []
-        new_conf = defaultdict(int)
-        for fen in self.possible_boards:
-            b = chess.Board(fen)
-            b.clear_stack()
-            if consistent(b):
-                new_boards.append(fen)
-                new_conf[fen] = self.board_confidence[fen] + 1
-
-        self.possible_boards = random.sample(new_boards, min(1000, len(new_boards)))
-        self.board_confidence = new_conf
+        #the sense is exact, so survivors keep their weight and the rest drop out
+        if isinstance(self.possible_boards, PendingExpansion):
+            self.possible_boards = self.possible_boards.filter_sense(sense_result, self.clock.deadline('sense'))
+        else:
+            self.possible_boards = self.possible_boards.filter_sense(sense_result)
+        if self.book_cursor is not None:
+            self.book_cursor.sensed(sense_result)
 
     def choose_move(self, move_actions, seconds_left):
+        self.clock.sync(seconds_left)
         #opening strategy
         if self.perform_opening:
             if self.current_move < len(self.opening_moves[self.color]):
@@ -142,69 +158,75 @@ class ImprovedAgent(Player):
                 self.perform_opening = False
         
 
-        boards = []
-        for fen in self.possible_boards:
-            b = chess.Board(fen)
-            b.clear_stack()
-            if b.turn == self.color:
-                boards.append(b)
+        #a move that takes the king on enough of the belief weight needs no search
+        king_capture = decisive_king_capture(self.possible_boards.with_turn(self.color), move_actions, self.color)
+        if king_capture is not None:
+            return king_capture
 
-        if not boards:
+        #no more boards than the engines can search at the shortest useful time
+        min_time = MIN_MULTIPV_TIME if self.multipv else MIN_SEARCH_TIME
+        affordable = self.clock.affordable('search', min_time / self.engine.size)
+        candidates = self.possible_boards.with_turn(self.color).resample(max(1, affordable))
+        if not len(candidates):
             return random.choice(move_actions)
 
-        if len(boards) > 10000:
-            boards = random.sample(boards, 10000)
-
-        stockfish_time = max(0.05, 10 / len(boards))
+        #heaviest boards go to the engines first, so a short clock cuts off the lightest
+        candidates = candidates.select(np.argsort(-candidates.weights, kind='stable'))
+        boards = list(candidates)
+        confidence = candidates.weights
+
+        #per-board search time from what is left of the turn, heavier boards get longer
+        stockfish_times = self.clock.allocate(confidence, 'search', workers=self.engine.size)
+        limits = [chess.engine.Limit(time=t) for t in stockfish_times]
+        deadline = self.clock.deadline('search')
+
+        if self.multipv:
+            move = choose_by_expected_score(self.engine, boards, confidence, move_actions, self.color, limits,
+                                            deadline)
+            if move is not None:
+                return move
        
+        #anytime vote: at the deadline the leader so far is played and the searches still
+        #running are cancelled. it also stops once the weight not yet heard from cannot
+        #overturn the leader
         move_counter = Counter()
-        king_targets = Counter()
-
-        for b in boards:
-            enemy_king = b.king(not self.color)
-            if enemy_king:
-                king_targets[enemy_king] += self.board_confidence[b.fen()]
-
-        if king_targets:
-            likely_king = king_targets.most_common(1)[0][0]
-            for mv in move_actions:
-                if mv.to_square == likely_king:
-                    return mv
-
-        for b in boards:
-            try:
-                fen = b.fen()
-                b.clear_stack()
-                result = self.engine.play(b, chess.engine.Limit(time=stockfish_time))
-                move = result.move
-                if move in move_actions:
-                    move_counter[move] += self.board_confidence[fen]
-            except:
-                continue
+        unheard = float(confidence.sum())
+        for i, result in self.engine.play_many(boards, limits, deadline=deadline):
+            unheard -= confidence[i]
+            if result is not None and result.move in move_actions:
+                move_counter[result.move] += confidence[i]
+            leaders = [w for _, w in move_counter.most_common(2)] + [0.0, 0.0]
+            if leaders[0] - leaders[1] > unheard:
+                break
 
         if move_counter:
             return move_counter.most_common(1)[0][0]
 
-        captures = [mv for b in boards for mv in b.generate_legal_captures() if mv in move_actions]
-        return random.choice(captures or move_actions)
+        #no search came back: go where an enemy piece is most likely to be taken
+        enemy = self.possible_boards.color_probability(not self.color)
+        target = max(move_actions, key=lambda mv: enemy[mv.to_square])
+        return target if enemy[target.to_square] > 0 else random.choice(move_actions)
 
     def handle_move_result(self, requested_move, taken_move, captured_opponent_piece, capture_square):
-        new_fens = []
-        for fen in self.possible_boards:
-            b = chess.Board(fen)
-            b.clear_stack()
-            if requested_move in b.legal_moves:
-                b.push(requested_move)
-                new_fens.append(b.fen())
-        self.possible_boards = random.sample(new_fens, min(1000, len(new_fens)))
+        #boards on which our move would have turned out differently drop out
+        self.possible_boards = self.possible_boards.apply_move_result(self.color, requested_move, taken_move,
+                                                                      capture_square)
+        if self.book_cursor is not None:
+            self.book_cursor.moved(requested_move, taken_move, capture_square)
+        self.clock.end_turn()
 
       
         self.current_move += 1
 
     def handle_game_end(self, winner_color, win_reason, game_history):
+        if not self.keep_engine:
+            self.close()
+
+    def close(self):
         try:
             self.engine.quit()
         except:
             pass
+        self.expansion.quit()
 
 
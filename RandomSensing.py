@@ -5,6 +5,12 @@ import chess.engine
 from reconchess import *
 from reconchess.utilities import without_opponent_pieces, is_illegal_castle 
 from collections import Counter
+from beliefs import BeliefStore, ParticleBudget, PendingExpansion, LAZY_EXPANSION
+from enginepool import EngineCache, STOCKFISH_PATH, POOL_SIZE, MULTIPV, choose_by_expected_score
+from engineservice import open_engine
+from timebudget import TimeBudget, MIN_SEARCH_TIME, MIN_MULTIPV_TIME
+from expansionpool import ExpansionPool
+from memorybudget import MemoryGovernor
 
 class RandomSensing(Player):
     def __init__(self):
@@ -13,38 +19,55 @@ class RandomSensing(Player):
        
         self.color = None
         self.board = None
-        self.possible_boards = []
+        self.possible_boards = BeliefStore()
         self.capture_square = None
         #self.engine = chess.engine.SimpleEngine.popen_uci('./stockfish.exe', setpgrp=True)
-        self.engine = chess.engine.SimpleEngine.popen_uci('/opt/stockfish/stockfish', setpgrp=True)
+        self.engine_cache = EngineCache()
+        self.engine = open_engine(POOL_SIZE, STOCKFISH_PATH, cache=self.engine_cache)
+        self.clock = TimeBudget()
+        self.particles = ParticleBudget()
+        #expand the opponent's move only once the sense result is known
+        self.lazy_expansion = LAZY_EXPANSION
+        #worker processes sharing large expansions, RBC_EXPANSION_WORKERS of them
+        self.expansion = ExpansionPool()
+        #resizes the particle budget each turn from the memory actually free
+        self.memory = MemoryGovernor(self.particles, processes=self.expansion.workers)
+        #set by harness.py when this instance plays many games, the engines then stay warm
+        self.keep_engine = False
+        #pick the move with the best weighted MultiPV score instead of voting
+        self.multipv = MULTIPV
 
     def handle_game_start(self, color, board, opponent_name):
        
         self.color = color
         self.board = board
-        self.possible_boards = [board.fen()]
+        self.possible_boards = BeliefStore([board])
+        self.clock = TimeBudget()
+        self.capture_square = None
+        if self.keep_engine:
+            return
         try:                                              
             self.engine.quit()                            
         except:                                          
             pass                                          
         #self.engine = chess.engine.SimpleEngine.popen_uci('./stockfish.exe', setpgrp=True)
-        self.engine = chess.engine.SimpleEngine.popen_uci('/opt/stockfish/stockfish', setpgrp=True)
+        self.engine = open_engine(POOL_SIZE, STOCKFISH_PATH, cache=self.engine_cache)
         
 
     def handle_opponent_move_result(self, captured_my_piece, capture_square):
-        
+        self.clock.start_turn()
         self.capture_square = capture_square
-        if captured_my_piece and capture_square is not None:
-        
-            filtered = []
-            for fen in self.possible_boards:
-                board = chess.Board(fen)
-                for move in board.pseudo_legal_moves:
-                    if move.to_square == capture_square:
-                        newboard = board.copy()
-                        newboard.push(move)
-                        filtered.append(newboard.fen())
-            self.possible_boards = sorted(filtered) 
+        parents = self.possible_boards.with_turn(not self.color)
+        if len(parents):
+            self.memory.update()
+            limit = self.particles.capacity(self.clock.remaining('update'))
+            if self.lazy_expansion:
+                self.possible_boards = PendingExpansion(parents, capture_square if captured_my_piece else None, limit,
+                                                        self.expansion, self.particles.slack)
+                return
+            self.possible_boards = self.expansion.expand(parents, capture_square if captured_my_piece else None,
+                                                         limit=limit, deadline=self.clock.deadline('update'),
+                                                         slack=self.particles.slack)
             
 
     def choose_sense(self, sense_actions, move_actions, seconds_left):
@@ -56,55 +79,50 @@ class RandomSensing(Player):
         return random.choice(non_edge_squares or sense_actions)
 
     def handle_sense_result(self, sense_result):
-    
-        def is_consistent(board): 
-            for square, expected in sense_result:
-                actual = board.piece_at(square)
-                if actual is None and expected is None:
-                    continue
-                if (actual is None) != (expected is None):
-                    return False
-                if actual.symbol() != expected.symbol():
-                    return False
-            return True
-
        
-        self.possible_boards = [
-            fen for fen in self.possible_boards if is_consistent(chess.Board(fen))
-        ]
+        if isinstance(self.possible_boards, PendingExpansion):
+            self.possible_boards = self.possible_boards.filter_sense(sense_result, self.clock.deadline('sense'))
+        else:
+            self.possible_boards = self.possible_boards.filter_sense(sense_result)
 
         
         
 
     def choose_move(self, move_actions, seconds_left):
-      
-        if not self.possible_boards:
+        self.clock.sync(seconds_left)
+        if not len(self.possible_boards):
             return random.choice(move_actions)
 
-        if len(self.possible_boards) > 10000:
-            self.possible_boards = random.sample(self.possible_boards, 10000)
+        min_time = MIN_MULTIPV_TIME if self.multipv else MIN_SEARCH_TIME
+        affordable = self.clock.affordable('search', min_time / self.engine.size)
+        self.possible_boards = self.possible_boards.resample(max(1, affordable))
 
-        N = len(self.possible_boards)
         move_counter = Counter()
-        time_per_board = max(0.01, 10 / N)
+        times = self.clock.allocate(self.possible_boards.weights, 'search', workers=self.engine.size)
 
-        for fen in self.possible_boards:
-            board = chess.Board(fen)
+        boards = list(self.possible_boards)
+        for board in boards:
             board.turn = self.color
-            try:
-                result = self.engine.play(board, chess.engine.Limit(time=time_per_board))
-                move = result.move
-                if move in move_actions:
-                    move_counter[move] += 1
-
-            except chess.engine.EngineTerminatedError:       
-                print("Stockfish engine died. Restarting...") 
-                #self.engine = chess.engine.SimpleEngine.popen_uci('./stockfish.exe', setpgrp=True) 
-                self.engine = chess.engine.SimpleEngine.popen_uci('/opt/stockfish/stockfish', setpgrp=True)
-                continue                                       
-            except chess.engine.EngineError:                  
-                print(f"Stockfish bad state at: {board.fen()}")  
-                continue  
+        #a row stands for all the particles merged or resampled into it, its vote counts that much
+        weights = self.possible_boards.weights
+
+        #the pool replaces engines that die, a None result is a board stockfish rejected
+        limits = [chess.engine.Limit(time=t) for t in times]
+        #the vote stops at the deadline, searches still running are cancelled
+        deadline = self.clock.deadline('search')
+        if self.multipv:
+            move = choose_by_expected_score(self.engine, boards, weights, move_actions, self.color, limits,
+                                            deadline)
+            if move is not None:
+                return move
+        for i, result in self.engine.play_many(boards, limits, deadline=deadline):
+            board = boards[i]
+            if result is None:
+                print(f"Stockfish bad state at: {board.fen()}")
+                continue
+            move = result.move
+            if move in move_actions:
+                move_counter[move] += weights[i]
                                                 
             
             #RBC casteling
@@ -112,32 +130,32 @@ class RandomSensing(Player):
                 rbc_board = without_opponent_pieces(board) 
                 for move in rbc_board.generate_castling_moves():  
                     if not is_illegal_castle(board, move) and move in move_actions: 
-                        move_counter[move] += 1 
+                        move_counter[move] += weights[i]
             except:
                 pass  
 
             #null move as valid move if allowed
             if chess.Move.null() in move_actions:  
-                move_counter[chess.Move.null()] += 1  
+                move_counter[chess.Move.null()] += weights[i]
 
         if move_counter:
             return move_counter.most_common(1)[0][0]
         return random.choice(move_actions)
 
     def handle_move_result(self, requested_move, taken_move, captured_opponent_piece, capture_square):
-        
-        updated = []
-        for fen in self.possible_boards:
-            board = chess.Board(fen)
-            if requested_move in board.legal_moves:
-                board.push(requested_move)
-                updated.append(board.fen())
-        self.possible_boards = updated
+        self.clock.end_turn()
+        self.possible_boards = self.possible_boards.apply_move_result(self.color, requested_move, taken_move,
+                                                                      capture_square)
 
     def handle_game_end(self, winner_color, win_reason, game_history):
+        if not self.keep_engine:
+            self.close()
+
+    def close(self):
         try:                            
             self.engine.quit()         
         except:                        
             print("Engine already terminated") 
+        self.expansion.quit()
 # #To run
 # #python -m reconchess.scripts.rc_bot_match RandomSensing reconchess.bots.random_bot
\ No newline at end of file
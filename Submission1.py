@@ -1,13 +1,12 @@
 import chess.engine
+from tactics import king_captures
 
 def find_king_capture_move(board):
-    for move in board.legal_moves:
-        board.push(move)
-        if not any(piece.symbol() == 'k' for piece in board.piece_map().values()):
-            board.pop()
-            return move
-        board.pop()
-    return None
+    #read off the attack bitboards, no move is pushed. only white can take the black king
+    if board.turn != chess.WHITE:
+        return None
+    moves = king_captures(board, legal=True)
+    return moves[0] if moves else None
 
 def get_best_move(fen):
     board = chess.Board(fen)
@@ -1,38 +1,66 @@
 import chess
 import chess.engine
+from enginepool import EnginePool, EngineCache, STOCKFISH_PATH, POOL_SIZE
+from tactics import king_captures
 
-def find_king_capture_move(board):
-    for move in board.legal_moves:
-        board.push(move)
-        if board.king(chess.BLACK) is None:
-            board.pop()
-            return move
-        board.pop()
-    return None
-
-def get_best_move(fen, engine):
-    board = chess.Board(fen)
-    move = find_king_capture_move(board)
+SEARCH_LIMIT = chess.engine.Limit(time=0.03)
 
-    if move is None:
-        result = engine.play(board, chess.engine.Limit(time=0.03))  
-        move = result.move
+def find_king_capture_move(board):
+    #read off the attack bitboards, no move is pushed. only white can take the black king
+    if board.turn != chess.WHITE:
+        return None
+    moves = king_captures(board, legal=True)
+    return moves[0] if moves else None
 
-    return move.uci()
+def decided(move_counts, remaining):
+    #true when no other move, seen or not, can catch the leader with the boards left
+    counts = sorted(move_counts.values(), reverse=True)
+    if not counts:
+        return False
+    runner_up = counts[1] if len(counts) > 1 else 0
+    return counts[0] > runner_up + remaining
 
 def analyze_moves(fen_list):
     move_counts = {}
+    first_seen = {}
+    cache = EngineCache()
+
+    def vote(move, i):
+        move_counts[move] = move_counts.get(move, 0) + 1
+        first_seen[move] = min(first_seen.get(move, i), i)
+
+    boards = [chess.Board(fen) for fen in fen_list]
+    searched = []
+    for i, board in enumerate(boards):
+        move = find_king_capture_move(board)
+        if move is None:
+            searched.append(i)
+        else:
+            vote(move.uci(), i)
 
-    with chess.engine.SimpleEngine.popen_uci('/opt/stockfish/stockfish') as engine:
-        for fen in fen_list:
-            move = get_best_move(fen, engine)
-            move_counts[move] = move_counts.get(move, 0) + 1
+    remaining = len(searched)
+    if searched and not decided(move_counts, remaining):
+        #boards are searched side by side, the vote stops once the leader is out of reach
+        #and leaving the loop cancels the searches still running
+        engine = EnginePool(POOL_SIZE, STOCKFISH_PATH, limit=SEARCH_LIMIT, cache=cache)
+        try:
+            for j, result in engine.play_many([boards[i] for i in searched], SEARCH_LIMIT):
+                remaining -= 1
+                if result is not None and result.move is not None:
+                    vote(result.move.uci(), searched[j])
+                if decided(move_counts, remaining):
+                    break
+        finally:
+            engine.quit()
 
-    most_common_move = max(move_counts.items(), key=lambda x: (x[1], -ord(x[0][0])))
+    #ties go to the lower first character, then to the move found on the earliest board,
+    #the order a serial pass over fen_list would have counted them in
+    most_common_move = max(move_counts.items(), key=lambda x: (x[1], -ord(x[0][0]), -first_seen[x[0]]))
     print(most_common_move[0])
 
 
-n = int(input())
-fen_list = [input() for _ in range(n)]
+if __name__ == "__main__":
+    n = int(input())
+    fen_list = [input() for _ in range(n)]
 
-analyze_moves(fen_list)
+    analyze_moves(fen_list)
@@ -1,12 +1,14 @@
 import chess.engine
 import random
 from reconchess import *
-import os
+from enginepool import EngineCache, STOCKFISH_PATH
+from engineservice import open_engine
 
 class TroutBot(Player):
     """
     TroutBot uses the Stockfish chess engine to choose moves.
-    Make sure stockfish.exe is in the same folder or update the path below.
+    The engine comes from the shared engine service when RBC_ENGINE_SERVICE is set,
+    otherwise Stockfish is started from STOCKFISH_PATH.
     """
 
     def __init__(self):
@@ -14,19 +16,17 @@ class TroutBot(Player):
         self.color = None
         self.my_piece_captured_square = None
 
-        # Direct path to stockfish executable (make sure this path is correct)
-        stockfish_path = ".\\stockfish.exe"
-
-
-        if not os.path.exists(stockfish_path):
-            raise ValueError(f'No stockfish executable found at "{stockfish_path}"')
-
-        # initialize the stockfish engine
-        self.engine = chess.engine.SimpleEngine.popen_uci(stockfish_path, setpgrp=True)
+        # initialize the stockfish engine, a single one is enough for one board
+        self.engine = open_engine(1, STOCKFISH_PATH)
+        # choose_sense and choose_move often search the same position, and positions repeat across turns
+        self.engine_cache = EngineCache()
+        # set by harness.py when this instance plays many games, the engine then stays warm
+        self.keep_engine = False
 
     def handle_game_start(self, color: Color, board: chess.Board, opponent_name: str):
         self.board = board
         self.color = color
+        self.my_piece_captured_square = None
 
     def handle_opponent_move_result(self, captured_my_piece: bool, capture_square: Optional[Square]):
         # if the opponent captured our piece, remove it from our board.
@@ -66,7 +66,7 @@ class TroutBot(Player):
         try:
             self.board.turn = self.color
             self.board.clear_stack()
-            result = self.engine.play(self.board, chess.engine.Limit(time=0.5))
+            result = self.engine_cache.play(self.engine, self.board, chess.engine.Limit(time=0.5))
             return result.move
         except chess.engine.EngineTerminatedError:
             print('Stockfish Engine died')
@@ -83,6 +83,10 @@ class TroutBot(Player):
 
     def handle_game_end(self, winner_color: Optional[Color], win_reason: Optional[WinReason],
                         game_history: GameHistory):
+        if not self.keep_engine:
+            self.close()
+
+    def close(self):
         try:
             self.engine.quit()
         except chess.engine.EngineTerminatedError:
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from part2sub1 import nextmoveprediction
+from part2sub2 import nextstateprediction
+from part2sub3 import nextstatepredictionwithcaptures
+from part2sub4 import filterconsistentstates
+from moves import apply_move
+
+#task name -> (function, request fields passed to it in order)
+TASKS = {
+    "part2sub1": (nextmoveprediction, ("fen",)),
+    "part2sub2": (nextstateprediction, ("fen",)),
+    "part2sub3": (nextstatepredictionwithcaptures, ("fen", "square")),
+    "part2sub4": (filterconsistentstates, ("fens", "window")),
+    "moves": (apply_move, ("fen", "move")),
+}
+
+#requests per unit of work sent to a worker, large enough that pickling is not the cost
+CHUNK_SIZE = 256
+
+
+def handle(line, default_task=None):
+    #one NDJSON request in, one NDJSON response out. a bad request answers with an error
+    #instead of stopping the stream
+    request = {}
+    try:
+        request = json.loads(line)
+        function, fields = TASKS[request.get("task", default_task)]
+        response = {"result": function(*(request[f] for f in fields))}
+    except Exception as e:
+        response = {"error": f"{type(e).__name__}: {e}"}
+    if isinstance(request, dict) and "id" in request:
+        response["id"] = request["id"]
+    return json.dumps(response)
+
+
+def handle_chunk(lines, default_task=None):
+    return [handle(line, default_task) for line in lines]
+
+
+def _chunks(lines, size):
+    lines = (line for line in lines if line.strip())
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream(lines, default_task=None, workers=1, chunk_size=CHUNK_SIZE):
+    #yields responses in request order. at most 2 chunks per worker are in flight, so
+    #input is read as it is consumed rather than all at once
+    if workers <= 1:
+        for chunk in _chunks(lines, chunk_size):
+            yield from handle_chunk(chunk, default_task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.submit(handle_chunk, chunk, default_task))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Runs the part2 scripts and moves.apply_move over "
+                                                 "newline-delimited JSON requests, one response line each.")
+    parser.add_argument("input", nargs="?", default="-", help="NDJSON request file, - for stdin")
+    parser.add_argument("--task", choices=sorted(TASKS), default=None,
+                        help="task for requests without a \"task\" field")
+    parser.add_argument("--output", default="-", help="NDJSON response file, - for stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for response in stream(source, args.task, args.workers, args.chunk_size):
+            out.write(response + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
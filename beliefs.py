@@ -0,0 +1,663 @@
+import os
+import random
+import time
+from functools import lru_cache
+import numpy as np
+import chess
+from reconchess.utilities import without_opponent_pieces, is_illegal_castle, revise_move, capture_square_of_move
+
+#leave the opponent-move expansion pending until the sense result says which children can exist
+LAZY_EXPANSION = os.environ.get('RBC_LAZY_EXPANSION', '0') == '1'
+
+#one row per candidate board: 12 piece bitboards (white P N B R Q K, then black p n b r q k)
+#plus the side to move, castling rights and ep square. move clocks are not stored.
+BOARD_DTYPE = np.dtype([
+    ('pieces', np.uint64, (12,)),
+    ('castling', np.uint64),
+    ('turn', np.bool_),
+    ('ep', np.int8),
+])
+
+
+#zobrist keys for the stored fields. seeded so hashes are stable between runs and processes
+_rng = np.random.default_rng(0x52424333)
+ZOBRIST_PIECES = _rng.integers(0, 2 ** 64, size=(12, 64), dtype=np.uint64)
+ZOBRIST_CASTLING = _rng.integers(0, 2 ** 64, size=64, dtype=np.uint64)
+ZOBRIST_EP = _rng.integers(0, 2 ** 64, size=64, dtype=np.uint64)
+ZOBRIST_TURN = _rng.integers(0, 2 ** 64, dtype=np.uint64)
+_Z_PIECES = ZOBRIST_PIECES.tolist()
+_Z_CASTLING = ZOBRIST_CASTLING.tolist()
+_Z_EP = ZOBRIST_EP.tolist()
+_Z_TURN = int(ZOBRIST_TURN)
+
+
+def piece_index(piece_type, color):
+    return piece_type - 1 + (0 if color == chess.WHITE else 6)
+
+
+def board_to_record(board):
+    white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+    bbs = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+    pieces = [bb & white for bb in bbs] + [bb & black for bb in bbs]
+    ep = -1 if board.ep_square is None else board.ep_square
+    return (pieces, board.castling_rights, board.turn, ep)
+
+
+def record_to_board(record):
+    #builds the board straight from the bitboards, no fen parsing
+    pieces = [int(bb) for bb in record['pieces']]
+    board = chess.Board(None)
+    board.pawns = pieces[0] | pieces[6]
+    board.knights = pieces[1] | pieces[7]
+    board.bishops = pieces[2] | pieces[8]
+    board.rooks = pieces[3] | pieces[9]
+    board.queens = pieces[4] | pieces[10]
+    board.kings = pieces[5] | pieces[11]
+    board.occupied_co[chess.WHITE] = pieces[0] | pieces[1] | pieces[2] | pieces[3] | pieces[4] | pieces[5]
+    board.occupied_co[chess.BLACK] = pieces[6] | pieces[7] | pieces[8] | pieces[9] | pieces[10] | pieces[11]
+    board.occupied = board.occupied_co[chess.WHITE] | board.occupied_co[chess.BLACK]
+    board.turn = bool(record['turn'])
+    board.castling_rights = int(record['castling'])
+    ep = int(record['ep'])
+    board.ep_square = None if ep < 0 else ep
+    return board
+
+
+def _bits_hash(bb, keys):
+    h = 0
+    for sq in chess.scan_forward(bb):
+        h ^= keys[sq]
+    return h
+
+
+def zobrist(record):
+    #full hash of a record tuple as returned by board_to_record
+    pieces, castling, turn, ep = record
+    h = _Z_TURN if turn else 0
+    for i, bb in enumerate(pieces):
+        h ^= _bits_hash(bb, _Z_PIECES[i])
+    h ^= _bits_hash(castling, _Z_CASTLING)
+    if ep >= 0:
+        h ^= _Z_EP[ep]
+    return h
+
+
+def zobrist_delta(old, new):
+    #xor of the keys that differ between two records. a move changes a handful of squares,
+    #so hash(new) == hash(old) ^ zobrist_delta(old, new) is much cheaper than rehashing
+    h = _Z_TURN if old[2] != new[2] else 0
+    for i in range(12):
+        changed = old[0][i] ^ new[0][i]
+        if changed:
+            h ^= _bits_hash(changed, _Z_PIECES[i])
+    h ^= _bits_hash(old[1] ^ new[1], _Z_CASTLING)
+    if old[3] != new[3]:
+        if old[3] >= 0:
+            h ^= _Z_EP[old[3]]
+        if new[3] >= 0:
+            h ^= _Z_EP[new[3]]
+    return h
+
+
+def rbc_moves(board):
+    #every move the side to move may have made: pseudo-legal moves, castling through
+    #check (legal in RBC) and passing
+    moves = list(board.pseudo_legal_moves)
+    for move in without_opponent_pieces(board).generate_castling_moves():
+        if not is_illegal_castle(board, move) and move not in moves:
+            moves.append(move)
+    moves.append(chess.Move.null())
+    return moves
+
+
+def capture_square_of(board, move):
+    #square of the piece `move` takes on `board`, None if it takes nothing
+    if not move:
+        return None
+    if board.is_en_passant(move):
+        return move.to_square + (-8 if board.turn == chess.WHITE else 8)
+    if board.occupied_co[not board.turn] & chess.BB_SQUARES[move.to_square]:
+        return move.to_square
+    return None
+
+
+def move_result_mask(store, color, requested_move, taken_move, capture_square):
+    #boolean mask of the boards on which the referee would have answered our move the way it
+    #did. our pieces are known, so only the opponent's decide the outcome: a slide stops on
+    #the first of them and takes it, a pawn push they block fails or stops short, a pawn
+    #capture with nothing to take fails, and the capture report must match
+    data = store.data
+    mask = data['turn'] == color
+    if requested_move is None or not len(store):
+        return mask
+    from_square, to_square = requested_move.from_square, requested_move.to_square
+    to_bb = chess.BB_SQUARES[to_square]
+    start = piece_index(chess.PAWN, color)
+    ours = data['pieces'][:, start:start + 6]
+    theirs = np.bitwise_or.reduce(data['pieces'][:, 6 - start:12 - start], axis=1)
+
+    def clear(bb):
+        return (theirs & np.uint64(bb)) == 0
+
+    #boards that cannot offer the move at all drop out: the moving piece is the one most of
+    #the weight has there, and none of our own pieces may stand in its way
+    movers = (ours & np.uint64(chess.BB_SQUARES[from_square])) != 0
+    piece_type = int(np.argmax(store.weights @ movers)) + 1
+    mask &= movers[:, piece_type - 1]
+    if piece_type == chess.KING and chess.square_distance(from_square, to_square) > 1:
+        #castling is rare enough to ask python-chess, board by board
+        return mask & np.array([bool(keep) and revise_move(b, requested_move) == taken_move and
+                                capture_square_of_move(b, taken_move) == capture_square
+                                for keep, b in zip(mask, store)], dtype=bool)
+    mask &= (np.bitwise_or.reduce(ours, axis=1) & np.uint64(chess.between(from_square, to_square) | to_bb)) == 0
+
+    if piece_type == chess.PAWN:
+        #reaching the last rank without naming a promotion never works
+        if to_bb & chess.BB_BACKRANKS and requested_move.promotion is None:
+            return mask & (taken_move is None and capture_square is None)
+        if chess.square_file(from_square) == chess.square_file(to_square):
+            first = chess.BB_SQUARES[from_square + (8 if color == chess.WHITE else -8)]
+            if capture_square is not None:
+                return mask & False
+            if taken_move is None:
+                return mask & ~clear(first)
+            if taken_move.to_square == to_square:
+                return mask & clear(first | to_bb)
+            return mask & clear(first) & ~clear(to_bb)
+        target = ~clear(to_bb)
+        behind = to_square + (-8 if color == chess.WHITE else 8)
+        ep_rank = chess.square_rank(to_square) == (5 if color == chess.WHITE else 2)
+        en_passant = ~target & (data['ep'] == to_square) & ep_rank
+        if taken_move is None:
+            return mask & ~target & ~en_passant if capture_square is None else mask & False
+        if capture_square == to_square:
+            return mask & target
+        if capture_square == behind:
+            return mask & en_passant
+        return mask & False
+
+    #knights, kings and sliders always move, sliders only as far as the first opponent piece
+    if taken_move is None:
+        return mask & False
+    taken_bb = chess.BB_SQUARES[taken_move.to_square]
+    mask &= clear(chess.between(from_square, taken_move.to_square))
+    if capture_square is None:
+        return mask & clear(taken_bb) if taken_move.to_square == to_square else mask & False
+    if capture_square != taken_move.to_square:
+        return mask & False
+    return mask & ~clear(taken_bb)
+
+
+def touched_squares(board, move, capture_square):
+    #squares whose contents `move` can change: both ends, the square of the piece it takes
+    #and, when castling, the whole back rank (a superset is all the sense filter needs)
+    if not move:
+        return 0
+    touched = chess.BB_SQUARES[move.from_square] | chess.BB_SQUARES[move.to_square]
+    if capture_square is not None:
+        touched |= chess.BB_SQUARES[capture_square]
+    if board.is_castling(move):
+        touched |= chess.BB_RANKS[chess.square_rank(move.from_square)]
+    return touched
+
+
+def expand_beliefs(store, capture_square, deadline=None, sense_result=None):
+    #streams (hash, record, weight, parent row) for every child of the boards in `store` whose capture
+    #matches what the referee reported: capture_square None means nothing of ours was taken.
+    #a parent's weight is split evenly over all its moves (a uniform opponent), and the hash
+    #is updated incrementally from the parent's so the caller can merge duplicates cheaply.
+    #past the time.monotonic() deadline no more parents are expanded, so with a deadline the
+    #parents are visited in random order to keep the cut unbiased.
+    #with a sense result only the children it agrees with are generated: a child can only
+    #agree if its move touches every window square where the parent disagrees, so most
+    #parents and moves are rejected before anything is pushed
+    hashes = store.hashes()
+    if sense_result is not None:
+        window, expected = compile_sense(sense_result)
+        diffs = np.bitwise_or.reduce((store.data['pieces'] & window) ^ expected, axis=1)
+        window, expected = int(window), expected.tolist()
+    order = np.arange(len(store)) if deadline is None else np.random.permutation(len(store))
+    for i in order:
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        diff = 0
+        if sense_result is not None:
+            diff = int(diffs[i])
+            #no move changes more than 4 squares (castling)
+            if chess.popcount(diff) > 4:
+                continue
+        record, parent_hash = store.data[i], int(hashes[i])
+        board = record_to_board(record)
+        parent = board_to_record(board)
+        moves = rbc_moves(board)
+        weight = store.weights[i] / len(moves)
+        for move in moves:
+            captured = capture_square_of(board, move)
+            if captured != capture_square:
+                continue
+            check = False
+            if sense_result is not None:
+                touched = touched_squares(board, move, captured)
+                if diff & ~touched:
+                    continue
+                #a move outside the window leaves it as the parent had it, which agrees
+                check = bool(touched & window)
+            board.push(move)
+            child = board_to_record(board)
+            board.pop()
+            if check and any((bb & window) != e for bb, e in zip(child[0], expected)):
+                continue
+            yield parent_hash ^ zobrist_delta(parent, child), child, weight, i
+
+
+def resample_plan(weights, n):
+    #systematic resampling: one random offset and n evenly spaced pointers into the weight
+    #cdf. returns the distinct rows picked and how many times each was picked
+    cdf = np.cumsum(weights)
+    points = (np.random.random() + np.arange(n)) / n * cdf[-1]
+    picked = np.minimum(np.searchsorted(cdf, points, side='right'), len(cdf) - 1)
+    return np.unique(picked, return_counts=True)
+
+
+def _thin(children, n):
+    #resamples the expansion dict down to n entries, the same plan as BeliefStore.resample
+    keys = list(children)
+    weights = np.array([children[k][1] for k in keys])
+    rows, copies = resample_plan(weights, n)
+    total = weights.sum()
+    return {keys[i]: [children[keys[i]][0], total * m / n, int(m), children[keys[i]][3]]
+            for i, m in zip(rows, copies)}
+
+
+def expanded_occupancy(parents, rows, children):
+    #(table, total) of an expansion, children[j] being a child of parents[rows[j]], without
+    #unpacking the children: each holds its parent's pieces but for the few squares its move
+    #changed, so the table is the parents' under their children's weight plus those squares
+    weights = children.weights
+    by_parent = np.bincount(rows, weights=weights, minlength=len(parents))
+    used = np.flatnonzero(by_parent)
+    table = weighted_occupancy(parents.data[used], by_parent[used]).ravel()
+    pieces = children.data['pieces']
+    changed = pieces ^ parents.data['pieces'][rows]
+    k, piece = np.nonzero(changed)
+    bits, held = changed[k, piece], pieces[k, piece]
+    #a move changes at most two squares of one piece bitboard, peeled off lowest bit first
+    while len(bits):
+        low = bits & (np.uint64(0) - bits)
+        square = np.log2(low.astype(np.float64)).astype(np.int64)
+        signed = np.where(held & low, weights[k], -weights[k])
+        table += np.bincount(piece * 64 + square, weights=signed, minlength=12 * 64)
+        bits = bits ^ low
+        keep = bits != 0
+        k, piece, bits, held = k[keep], piece[keep], bits[keep], held[keep]
+    return np.maximum(table, 0.0).reshape(12, 64), float(weights.sum())
+
+
+#measured costs that turn a memory or time budget into a particle count
+BYTES_PER_CHILD = 400
+EXPAND_SECONDS_PER_PARTICLE = 5e-3
+#the expansion dict may grow to this multiple of the budget before it is thinned
+RESAMPLE_SLACK = 2
+
+
+class ParticleBudget:
+    """
+    How many weighted particles the agent can afford to carry. A particle costs its packed
+    row plus its share of the expansion dict while the next turn is generated, and about
+    EXPAND_SECONDS_PER_PARTICLE of update time. A MemoryGovernor may resize max_bytes and
+    slack from turn to turn.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, min_particles=100, max_particles=None, slack=RESAMPLE_SLACK):
+        self.max_bytes = max_bytes
+        self.min_particles = min_particles
+        self.max_particles = max_particles
+        #multiple of the capacity the expansion dict reaches before it is thinned
+        self.slack = slack
+
+    def bytes_per_particle(self):
+        return BOARD_DTYPE.itemsize + 16 + self.slack * BYTES_PER_CHILD
+
+    def capacity(self, seconds=None):
+        cap = int(self.max_bytes // self.bytes_per_particle())
+        if seconds is not None:
+            cap = min(cap, int(seconds / EXPAND_SECONDS_PER_PARTICLE))
+        if self.max_particles is not None:
+            cap = min(cap, self.max_particles)
+        return max(self.min_particles, cap)
+
+
+@lru_cache(maxsize=None)
+def window_squares(center):
+    #squares covered by a 3x3 sense centred on `center`, clipped at the edges
+    f, r = chess.square_file(center), chess.square_rank(center)
+    return tuple(
+        chess.square(x, y)
+        for x in range(f - 1, f + 2)
+        for y in range(r - 1, r + 2)
+        if 0 <= x < 8 and 0 <= y < 8
+    )
+
+
+def interior_squares(squares):
+    #sense centres whose window lies fully on the board (the 6x6 block), edge windows see less
+    return [sq for sq in squares if 1 <= chess.square_file(sq) <= 6 and 1 <= chess.square_rank(sq) <= 6]
+
+
+#rows unpacked at a time when counting occupancy, bounds the temporary bit arrays
+OCCUPANCY_BLOCK = 1024
+
+
+def weighted_occupancy(data, weights):
+    #(12, 64) sum of the weights of the rows holding each piece on each square
+    table = np.zeros(12 * 64)
+    for start in range(0, len(data), OCCUPANCY_BLOCK):
+        pieces = np.ascontiguousarray(data['pieces'][start:start + OCCUPANCY_BLOCK], dtype='<u8')
+        bits = np.unpackbits(pieces.view(np.uint8).reshape(len(pieces), 96), axis=1, bitorder='little')
+        table += weights[start:start + OCCUPANCY_BLOCK] @ bits
+    return table.reshape(12, 64)
+
+
+def occupancy_after_move(occupancy, color, move, capture_square):
+    #the (table, total) once our move is played on every board. the boards agree on our
+    #pieces and on what the move took, so only a few entries change. None for castling,
+    #which is left to be counted again
+    if move is None:
+        return occupancy
+    table, total = occupancy
+    start = piece_index(chess.PAWN, color)
+    mover = start + int(np.argmax(table[start:start + 6, move.from_square]))
+    if mover == piece_index(chess.KING, color) and chess.square_distance(move.from_square, move.to_square) > 1:
+        return None
+    table = table.copy()
+    moved = table[mover, move.from_square]
+    table[mover, move.from_square] = 0.0
+    if capture_square is not None:
+        table[6 - start:12 - start, capture_square] = 0.0
+    table[mover if move.promotion is None else piece_index(move.promotion, color), move.to_square] = moved
+    return table, total
+
+
+def compile_sense(sense_result):
+    #turns a sense result into the window mask plus the expected contents of the window
+    #for each of the 12 piece bitboards, so a board matches iff (bb & window) == expected
+    window = 0
+    expected = [0] * 12
+    for square, piece in sense_result:
+        window |= chess.BB_SQUARES[square]
+        if piece is not None:
+            expected[piece_index(piece.piece_type, piece.color)] |= chess.BB_SQUARES[square]
+    return np.uint64(window), np.array(expected, dtype=np.uint64)
+
+
+class BeliefStore:
+    """
+    Set of candidate boards kept as packed bitboards in a NumPy structured array.
+    A chess.Board is only built when something (the engine, move generation) needs one.
+    Rows are weighted particles: each unique position carries a weight and the number of
+    particles merged into it (its multiplicity).
+    """
+
+    def __init__(self, boards=(), weights=None, counts=None):
+        self._set_records([board_to_record(b) for b in boards], weights, counts)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        #(weighted occupancy table, total weight) of the current rows and weights, None until
+        #counted. replacing either drops it, stores derived from this one update it instead
+        self._occupancy = None
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        self._weights = weights
+        self._occupancy = None
+
+    def _set_records(self, records, weights, counts=None):
+        self.data = np.array(records, dtype=BOARD_DTYPE)
+        n = len(self.data)
+        self.weights = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.counts = np.ones(n, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_fens(cls, fens):
+        return cls(chess.Board(fen) for fen in fens)
+
+    @classmethod
+    def from_records(cls, records, weights=None, counts=None):
+        store = cls()
+        store._set_records(records, weights, counts)
+        return store
+
+    @classmethod
+    def from_arrays(cls, data, weights=None, counts=None):
+        store = cls()
+        store.data = data
+        store.weights = np.ones(len(data)) if weights is None else weights
+        store.counts = np.ones(len(data), dtype=np.int64) if counts is None else counts
+        return store
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return self.boards()
+
+    def board(self, i):
+        return record_to_board(self.data[i])
+
+    def boards(self):
+        for record in self.data:
+            yield record_to_board(record)
+
+    def fens(self):
+        return [b.fen() for b in self.boards()]
+
+    def select(self, index):
+        #index is a boolean mask or an array of row numbers
+        store = BeliefStore.from_arrays(self.data[index], self.weights[index], self.counts[index])
+        index = np.asarray(index)
+        if self._occupancy is not None and index.dtype == bool:
+            #while fewer rows go than stay, taking them off beats counting the rest
+            dropped = ~index
+            if 2 * np.count_nonzero(dropped) < len(self):
+                table, total = self._occupancy
+                removed = weighted_occupancy(self.data[dropped], self.weights[dropped])
+                store._occupancy = (np.maximum(table - removed, 0.0), total - float(self.weights[dropped].sum()))
+        return store
+
+    def with_turn(self, color):
+        return self.select(self.data['turn'] == color)
+
+    def consistent_with(self, sense_result):
+        #boolean mask of the boards that agree with every square of the sense result
+        window, expected = compile_sense(sense_result)
+        return ((self.data['pieces'] & window) == expected).all(axis=1)
+
+    def filter_sense(self, sense_result):
+        return self.select(self.consistent_with(sense_result))
+
+    def piece_bits(self):
+        #(N, 12, 64) array of 0/1, one entry per board, piece bitboard and square
+        pieces = np.ascontiguousarray(self.data['pieces'], dtype='<u8')
+        return np.unpackbits(pieces.view(np.uint8).reshape(len(self), 12, 8), axis=2, bitorder='little')
+
+    def square_codes(self):
+        #(N, 64) array holding the piece index on each square, 12 for an empty square
+        bits = self.piece_bits()
+        return np.where(bits.any(axis=1), bits.argmax(axis=1), 12).astype(np.int64)
+
+    def occupancy(self):
+        #(12, 64) belief weight of the boards holding each piece on each square, and the total
+        #weight. built during expansion, kept up to date as rows are dropped, merged or moved,
+        #and only counted when a store was made some other way
+        if self._occupancy is None:
+            self._occupancy = (weighted_occupancy(self.data, self.weights), float(self.weights.sum()))
+        return self._occupancy
+
+    def piece_probability(self, piece_type, color):
+        #weighted probability of that piece standing on each of the 64 squares
+        table, total = self.occupancy()
+        if total <= 0:
+            return np.zeros(64)
+        return table[piece_index(piece_type, color)] / total
+
+    def color_probability(self, color):
+        #weighted probability of each square holding any piece of that colour
+        table, total = self.occupancy()
+        if total <= 0:
+            return np.zeros(64)
+        start = piece_index(chess.PAWN, color)
+        return table[start:start + 6].sum(axis=0) / total
+
+    def sense_gains(self, squares):
+        #expected information gain (bits) of sensing at each square. the sense outcome is fixed
+        #by the board, so the gain is the entropy of the weighted outcome histogram
+        if not len(self):
+            return {sq: 0.0 for sq in squares}
+        codes = self.square_codes()
+        probs = self.weights / self.weights.sum()
+        gains = {}
+        for sq in squares:
+            key = np.zeros(len(self), dtype=np.int64)
+            for window_sq in window_squares(sq):
+                key = key * 13 + codes[:, window_sq]
+            _, outcome = np.unique(key, return_inverse=True)
+            p = np.bincount(outcome, weights=probs)
+            p = p[p > 0]
+            gains[sq] = float(-(p * np.log2(p)).sum())
+        return gains
+
+    def hashes(self):
+        #zobrist hash of every board, same values as zobrist(board_to_record(board))
+        bits = self.piece_bits().astype(bool)
+        zero = np.uint64(0)
+        h = np.where(self.data['turn'], ZOBRIST_TURN, zero)
+        for i in range(12):
+            h ^= np.bitwise_xor.reduce(np.where(bits[:, i, :], ZOBRIST_PIECES[i], zero), axis=1)
+        castling = np.ascontiguousarray(self.data['castling'], dtype='<u8').view(np.uint8)
+        castling = np.unpackbits(castling.reshape(len(self), 8), axis=1, bitorder='little').astype(bool)
+        h ^= np.bitwise_xor.reduce(np.where(castling, ZOBRIST_CASTLING, zero), axis=1)
+        ep = self.data['ep'].astype(np.int64)
+        h ^= np.where(ep >= 0, ZOBRIST_EP[np.maximum(ep, 0)], zero)
+        return h
+
+    def expand(self, capture_square, limit=None, deadline=None, sense_result=None, slack=RESAMPLE_SLACK):
+        #children of every board after one move of the side to move. children reached from
+        #several parents are merged and their weights added. with a limit the set is thinned
+        #by systematic resampling whenever it outgrows slack * limit, so memory stays bounded.
+        #with a sense result the children it rules out are never generated
+        children = {}
+        for key, child, weight, parent in expand_beliefs(self, capture_square, deadline, sense_result):
+            entry = children.get(key)
+            if entry is not None:
+                entry[1] += weight
+                entry[2] += 1
+                continue
+            children[key] = [child, weight, 1, parent]
+            if limit is not None and len(children) > slack * limit:
+                children = _thin(children, limit)
+        if limit is not None and len(children) > limit:
+            children = _thin(children, limit)
+        entries = list(children.values())
+        store = BeliefStore.from_records([e[0] for e in entries], [e[1] for e in entries],
+                                         [e[2] for e in entries])
+        #the occupancy table comes from the parents rather than from a pass over the children
+        store._occupancy = expanded_occupancy(self, np.fromiter((e[3] for e in entries), np.int64, len(entries)),
+                                              store)
+        return store
+
+    def apply_move_result(self, color, requested_move, taken_move, capture_square):
+        #keeps the boards that agree with the referee's answer to our move and plays the
+        #move that was actually taken on them, a pass when it failed
+        store = self.select(move_result_mask(self, color, requested_move, taken_move, capture_square))
+        records = []
+        for board in store:
+            board.push(taken_move or chess.Move.null())
+            records.append(board_to_record(board))
+        result = BeliefStore.from_records(records, store.weights, store.counts)
+        if store._occupancy is not None:
+            result._occupancy = occupancy_after_move(store._occupancy, color, taken_move, capture_square)
+        return result
+
+    def resample(self, n):
+        #systematic resampling down to at most n rows. a row picked k times is kept once with
+        #multiplicity k, so the total weight is preserved and no copies are stored
+        if len(self) <= n:
+            return self
+        rows, copies = resample_plan(self.weights, n)
+        store = self.select(rows)
+        store.weights = self.weights.sum() * copies / n
+        store.counts = copies.astype(np.int64)
+        return store
+
+    def sample(self, k):
+        if len(self) <= k:
+            return self
+        return self.select(np.sort(np.array(random.sample(range(len(self)), k))))
+
+    def merge(self, hashes=None):
+        #folds identical positions into one row, adding up their weights and multiplicities.
+        #hashes, when the caller already has them, must be those of hashes()
+        _, first, inverse = np.unique(self.hashes() if hashes is None else hashes, return_index=True,
+                                      return_inverse=True)
+        store = BeliefStore.from_arrays(self.data[first],
+                                        np.bincount(inverse, weights=self.weights),
+                                        np.bincount(inverse, weights=self.counts).astype(np.int64))
+        #same weight on every square, only spread over fewer rows
+        store._occupancy = self._occupancy
+        return store
+
+    def concat(self, other):
+        store = BeliefStore.from_arrays(np.concatenate([self.data, other.data]),
+                                        np.concatenate([self.weights, other.weights]),
+                                        np.concatenate([self.counts, other.counts]))
+        if self._occupancy is not None and other._occupancy is not None:
+            store._occupancy = (self._occupancy[0] + other._occupancy[0], self._occupancy[1] + other._occupancy[1])
+        return store
+
+
+class PendingExpansion:
+    """
+    Opponent-move expansion waiting for the sense result, which in RBC always comes next.
+    Holds the parent beliefs and the capture report; filter_sense then generates only the
+    children the sense agrees with instead of building them all and discarding most.
+    """
+
+    def __init__(self, parents, capture_square, limit=None, pool=None, slack=RESAMPLE_SLACK):
+        self.parents = parents
+        self.capture_square = capture_square
+        self.limit = limit
+        self.slack = slack
+        #an ExpansionPool to shard the expansion over, None expands in process
+        self.pool = pool
+
+    def __len__(self):
+        #the parents, how many children there are is not known yet
+        return len(self.parents)
+
+    def preview(self, n):
+        #about n children to plan the sense on, from parents drawn by weight in random order
+        parents = self.parents.resample(n)
+        parents = parents.select(np.random.permutation(len(parents)))
+        records, weights = [], []
+        for _, child, weight, _ in expand_beliefs(parents, self.capture_square):
+            records.append(child)
+            weights.append(weight)
+            if len(records) >= n:
+                break
+        return BeliefStore.from_records(records, weights)
+
+    def filter_sense(self, sense_result, deadline=None):
+        if self.pool is not None:
+            return self.pool.expand(self.parents, self.capture_square, self.limit, deadline, sense_result,
+                                    self.slack)
+        return self.parents.expand(self.capture_square, self.limit, deadline, sense_result, self.slack)
@@ -0,0 +1,271 @@
+import argparse
+import concurrent.futures
+import contextlib
+import copy
+import importlib
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import chess
+import chess.engine
+from reconchess.utilities import move_actions, revise_move, capture_square_of_move
+from beliefs import BeliefStore, window_squares, interior_squares
+
+#the corpus only depends on these seeds and python-chess, so timings stay comparable
+#across changes to the agents. plies is odd so white has just moved, histories is the
+#number of alternative opponent histories in the belief set
+CASES = {
+    "small": dict(seed=11, plies=9, histories=50, capture=False),
+    "post_capture": dict(seed=23, plies=17, histories=3000, capture=True),
+    "exploded": dict(seed=37, plies=21, histories=10000, capture=False),
+}
+
+AGENTS = ["ImprovedAgent", "RandomSensing"]
+
+#in the order the referee calls them: the sense is chosen on the freshly expanded beliefs
+CALLBACKS = ["handle_opponent_move_result", "choose_sense", "handle_sense_result", "choose_move",
+             "handle_move_result"]
+
+#fewest boards a callback may be timed on, a case whose beliefs collapse measures nothing
+MIN_BOARDS = 20
+
+#slowdowns bigger than this fraction, and than MIN_DELTA seconds, are flagged as regressions
+TOLERANCE = 0.10
+MIN_DELTA = 0.002
+
+
+class MockEnginePool:
+    """Stands in for EnginePool: answers instantly with the first legal move, no processes."""
+
+    def __init__(self, size=1, *args, **kwargs):
+        self.size = size
+        self.cache = kwargs.get("cache")
+        self.calls = 0
+
+    def play(self, board, limit=None, **kwargs):
+        self.calls += 1
+        move = next(iter(board.legal_moves), None)
+        return chess.engine.PlayResult(move, None)
+
+    def analyse(self, board, limit=None, multipv=None, root_moves=None, **kwargs):
+        #every move scores 0, one info per move with multipv as the engine would give
+        self.calls += 1
+        moves = list(root_moves or board.legal_moves)
+        infos = [{"pv": [move], "score": chess.engine.PovScore(chess.engine.Cp(0), board.turn)}
+                 for move in moves[:multipv or 1]]
+        if multipv is None:
+            return infos[0] if infos else {"pv": []}
+        return infos
+
+    def analyse_many(self, boards, limit=None, root_moves=None, deadline=None, **kwargs):
+        for i, board in enumerate(boards):
+            moves = root_moves[i] if root_moves and isinstance(root_moves[0], list) else root_moves
+            yield i, self.analyse(board, root_moves=moves, **kwargs)
+
+    def submit(self, board, limit=None, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(self.play(board))
+        return future
+
+    def play_many(self, boards, limit=None, deadline=None, **kwargs):
+        for i, board in enumerate(boards):
+            yield i, self.play(board)
+
+    def quit(self):
+        pass
+
+
+@contextlib.contextmanager
+def stub_engines(player_class):
+    #the bots build their engines in __init__ and sometimes handle_game_start, so the engine
+    #factories imported by the bot's module and SimpleEngine.popen_uci are swapped meanwhile
+    module = sys.modules[player_class.__module__]
+    saved = {name: getattr(module, name) for name in ("EnginePool", "open_engine") if hasattr(module, name)}
+    saved_popen = chess.engine.SimpleEngine.popen_uci
+    for name in saved:
+        setattr(module, name, MockEnginePool)
+    chess.engine.SimpleEngine.popen_uci = staticmethod(lambda *args, **kwargs: MockEnginePool())
+    try:
+        yield
+    finally:
+        for name, factory in saved.items():
+            setattr(module, name, factory)
+        chess.engine.SimpleEngine.popen_uci = saved_popen
+
+
+def _replay(rng, our_moves, plies):
+    #our moves are known, the opponent's are not: replay ours (or pass when one no longer
+    #applies) and pick the opponent's at random
+    board = chess.Board()
+    for ply in range(plies):
+        if ply % 2 == 0:
+            move = our_moves[ply // 2]
+            board.push(move if board.is_pseudo_legal(move) else chess.Move.null())
+        else:
+            moves = list(board.pseudo_legal_moves)
+            board.push(rng.choice(moves) if moves else chess.Move.null())
+    return board
+
+
+def build_case(seed, plies, histories, capture):
+    #white's view of a game after its own move: the true board plus `histories` alternative
+    #opponent histories, then the true opponent reply (a capture for post-capture cases)
+    rng = random.Random(seed)
+    while True:
+        truth = chess.Board()
+        for _ in range(plies):
+            truth.push(rng.choice(list(truth.legal_moves)))
+        replies = [m for m in truth.legal_moves if truth.is_capture(m) == capture and not truth.is_en_passant(m)]
+        if replies and truth.king(chess.WHITE) is not None:
+            break
+    our_moves = [truth.move_stack[i] for i in range(0, plies, 2)]
+    beliefs = [truth.copy(stack=False)] + [_replay(rng, our_moves, plies) for _ in range(histories)]
+
+    reply = rng.choice(replies)
+    capture_square = reply.to_square if capture else None
+    truth.push(reply)
+
+    #the sense that splits the beliefs most evenly: it rules out as many as it keeps, where a
+    #window on the king would usually leave one board for the rest of the turn
+    store = BeliefStore(beliefs).merge()
+    results = {sq: [(s, truth.piece_at(s)) for s in window_squares(sq)] for sq in interior_squares(chess.SQUARES)}
+    kept = {sq: int(store.consistent_with(result).sum()) for sq, result in results.items()}
+    sense_square = min(kept, key=lambda sq: (abs(kept[sq] - len(store) / 2), sq))
+    sense_result = results[sense_square]
+
+    actions = move_actions(truth)
+    requested = sorted(actions, key=lambda m: m.uci())[0]
+    taken = revise_move(truth, requested)
+    our_capture = capture_square_of_move(truth, taken)
+    return {
+        "beliefs": store,
+        "capture_square": capture_square,
+        "sense_result": sense_result,
+        "sense_actions": list(chess.SQUARES),
+        "move_actions": actions,
+        "move_result": (requested, taken, our_capture is not None, our_capture),
+    }
+
+
+def make_agent(name):
+    module = importlib.import_module(name)
+    with stub_engines(getattr(module, name)):
+        agent = getattr(module, name)()
+        agent.handle_game_start(chess.WHITE, chess.Board(), "benchmark")
+    #a large clock so deadlines never cut a callback short
+    agent.clock.seconds_left = 1e6
+    if hasattr(agent, "perform_opening"):
+        agent.perform_opening = False
+    #a built book would swap the corpus beliefs for its own and answer the sense from them
+    if hasattr(agent, "book"):
+        agent.book = None
+        agent.book_cursor = None
+    return agent
+
+
+def _call(agent, callback, case):
+    if callback == "handle_opponent_move_result":
+        captured = case["capture_square"] is not None
+        return agent.handle_opponent_move_result(captured, case["capture_square"])
+    if callback == "handle_sense_result":
+        return agent.handle_sense_result(case["sense_result"])
+    if callback == "choose_sense":
+        return agent.choose_sense(case["sense_actions"], case["move_actions"], 1e6)
+    if callback == "choose_move":
+        return agent.choose_move(case["move_actions"], 1e6)
+    return agent.handle_move_result(*case["move_result"])
+
+
+def _state_before(agent, case):
+    #belief sets each callback sees in a real turn, computed once outside the timings
+    states = {}
+    agent.possible_boards = case["beliefs"]
+    agent.clock.start_turn()
+    for callback in CALLBACKS:
+        states[callback] = agent.possible_boards
+        _call(agent, callback, case)
+    return states
+
+
+def bench_agent(name, case, repeats=3):
+    agent = make_agent(name)
+    states = _state_before(agent, case)
+    results = {}
+    for callback in CALLBACKS:
+        times = []
+        boards = len(states[callback])
+        if boards < MIN_BOARDS:
+            raise RuntimeError(f"{name}: {callback} would be timed on {boards} boards, the case has collapsed")
+        for _ in range(repeats):
+            agent.possible_boards = copy.copy(states[callback])
+            agent.clock.start_turn()
+            start = time.perf_counter()
+            _call(agent, callback, case)
+            times.append(time.perf_counter() - start)
+        #tracing allocations slows python code several times over, so memory gets its own run
+        agent.possible_boards = copy.copy(states[callback])
+        agent.clock.start_turn()
+        tracemalloc.start()
+        _call(agent, callback, case)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        seconds = statistics.median(times)
+        results[callback] = {
+            "boards": boards,
+            "seconds": round(seconds, 6),
+            "boards_per_sec": round(boards / seconds, 1) if seconds > 0 else None,
+            "peak_bytes": peak,
+        }
+    return results
+
+
+def compare(results, baseline):
+    regressions = []
+    for key, callbacks in results.items():
+        for callback, now in callbacks.items():
+            before = baseline.get(key, {}).get(callback)
+            if not before:
+                continue
+            ratio = now["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+            slower = ratio > 1 + TOLERANCE and now["seconds"] - before["seconds"] > MIN_DELTA
+            flag = "  REGRESSION" if slower else ""
+            print(f"{key:32} {callback:28} {before['seconds']:.4f}s -> {now['seconds']:.4f}s ({ratio:.2f}x){flag}")
+            if flag:
+                regressions.append((key, callback))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--agents", nargs="*", default=AGENTS)
+    parser.add_argument("--cases", nargs="*", default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--save-baseline", metavar="PATH", help="write these results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for case_name in args.cases:
+        case = build_case(**CASES[case_name])
+        for agent_name in args.agents:
+            key = f"{agent_name}/{case_name}"
+            results[key] = bench_agent(agent_name, case, args.repeats)
+            for callback, r in results[key].items():
+                print(f"{key:32} {callback:28} {r['boards']:6d} boards {r['seconds']:.4f}s "
+                      f"{r['boards_per_sec'] or 0:12.0f} boards/s {r['peak_bytes'] / 2 ** 20:8.2f} MiB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import chess
+import chess.engine
+import chess.polyglot
+import numpy as np
+from reconchess.utilities import revise_move
+
+#defaults can be overridden per machine without touching the bots
+STOCKFISH_PATH = os.environ.get('STOCKFISH_PATH', '/opt/stockfish/stockfish')
+POOL_SIZE = int(os.environ.get('RBC_ENGINE_POOL_SIZE', os.cpu_count() or 1))
+SEARCH_LIMIT = chess.engine.Limit(time=float(os.environ.get('RBC_SEARCH_TIME', 0.05)))
+CACHE_SIZE = int(os.environ.get('RBC_ENGINE_CACHE_SIZE', 200000))
+#choose moves by expected MultiPV score over the beliefs instead of counting top moves
+MULTIPV = os.environ.get('RBC_MULTIPV', '0') == '1'
+
+#centipawns a forced mate is worth when scores are averaged over boards
+MATE_SCORE = 10000
+
+#what the engine needs to report back for a result to be cacheable
+SEARCH_INFO = chess.engine.INFO_BASIC | chess.engine.INFO_SCORE
+
+#time is the search's time limit, None when it was only limited by depth
+CacheEntry = namedtuple('CacheEntry', ['move', 'score', 'depth', 'time'])
+
+
+class EngineCache:
+    """
+    LRU cache of engine results keyed by the position's zobrist hash, which leaves out the
+    move clocks so the same position reached on different turns shares one entry.
+    An entry answers a request when its search covered it: at least as deep and at least as
+    long, and at least min_depth for time limited requests. With reuse_deeper off it has to
+    have been searched with exactly the limit asked for.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, reuse_deeper=True, min_depth=0):
+        self.maxsize = maxsize
+        self.reuse_deeper = reuse_deeper
+        #depth a cached result needs when the search is time limited rather than depth limited
+        self.min_depth = min_depth
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        #the pool stores results from its event loop thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _covers(self, entry, limit):
+        if limit.depth is not None:
+            if entry.depth < limit.depth or (not self.reuse_deeper and entry.depth != limit.depth):
+                return False
+        elif entry.depth < self.min_depth:
+            return False
+        if limit.time is not None:
+            if entry.time is None or entry.time < limit.time or (not self.reuse_deeper and entry.time != limit.time):
+                return False
+        return True
+
+    def get(self, board, limit):
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._covers(entry, limit):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, board, result, limit):
+        key = chess.polyglot.zobrist_hash(board)
+        info = result.info or {}
+        entry = CacheEntry(result.move, info.get('score'), info.get('depth', 0), limit.time)
+        with self._lock:
+            old = self._entries.get(key)
+            #never overwrite a deeper or longer search with a lesser one
+            if old is None or (old.depth <= entry.depth and (old.time or 0) <= (entry.time or 0)):
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def play(self, engine, board, limit):
+        #engine.play through the cache, for bots holding a single SimpleEngine
+        entry = self.get(board, limit)
+        if entry is not None:
+            return as_play_result(entry)
+        result = engine.play(board, limit, info=SEARCH_INFO)
+        self.put(board, result, limit)
+        return result
+
+
+def cacheable(kwargs):
+    #a search the cache can answer: no options beyond asking for info the cache keeps
+    return set(kwargs) <= {'info'} and not kwargs.get('info', SEARCH_INFO) & ~SEARCH_INFO
+
+
+def as_play_result(entry):
+    return chess.engine.PlayResult(entry.move, None, info={'score': entry.score, 'depth': entry.depth})
+
+
+def _completed(futures, deadline=None):
+    #as_completed that ends quietly at the deadline instead of waiting for slow searches
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        yield from concurrent.futures.as_completed(futures, timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        return
+
+
+class EnginePool:
+    """
+    A pool of Stockfish processes driven through chess.engine's asyncio protocol.
+    The event loop runs on a background thread so the bots can stay synchronous:
+    play_many fans boards out over the idle engines and yields results as they finish.
+    """
+
+    def __init__(self, size=POOL_SIZE, path=STOCKFISH_PATH, limit=SEARCH_LIMIT, options=None, cache=None):
+        self.size = max(1, size)
+        self.path = path
+        self.limit = limit
+        self.cache = cache
+        self.options = options or {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._idle = None
+        self._engines = []
+        #engines still stopping a cancelled search
+        self._releasing = set()
+        self._run(self._start())
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _open_engine(self):
+        _, engine = await chess.engine.popen_uci(self.path, setpgrp=True)
+        if self.options:
+            await engine.configure(self.options)
+        self._engines.append(engine)
+        return engine
+
+    async def _start(self):
+        #the queue has to be created on the loop's own thread
+        self._idle = asyncio.Queue()
+        engines = await asyncio.gather(*(self._open_engine() for _ in range(self.size)))
+        for engine in engines:
+            self._idle.put_nowait(engine)
+
+    async def _with_engine(self, command):
+        engine = await self._idle.get()
+        try:
+            result = await command(engine)
+        except asyncio.CancelledError:
+            #the engine is still stopping the search. a command queued behind the stop and
+            #cancelled in turn breaks python-chess's command queue, so it rejoins the pool
+            #only once it answers again
+            task = asyncio.ensure_future(self._release(engine))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+            engine = None
+            raise
+        except chess.engine.EngineTerminatedError:
+            #replace the dead process so the pool keeps its size
+            self._engines.remove(engine)
+            engine = await self._open_engine()
+            raise
+        finally:
+            if engine is not None:
+                self._idle.put_nowait(engine)
+        return result
+
+    async def _release(self, engine):
+        try:
+            await engine.ping()
+        except chess.engine.EngineTerminatedError:
+            self._engines.remove(engine)
+            engine = await self._open_engine()
+        self._idle.put_nowait(engine)
+
+    async def _cached_play(self, engine, board, limit):
+        result = await engine.play(board, limit, info=SEARCH_INFO)
+        self.cache.put(board, result, limit)
+        return result
+
+    def submit(self, board, limit=None, **kwargs):
+        #schedules one search and returns a concurrent.futures.Future for its PlayResult
+        limit = limit or self.limit
+        board = board.copy(stack=False)
+        if self.cache is None or not cacheable(kwargs):
+            coro = self._with_engine(lambda engine: engine.play(board, limit, **kwargs))
+            return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+        entry = self.cache.get(board, limit)
+        if entry is not None:
+            future = concurrent.futures.Future()
+            future.set_result(as_play_result(entry))
+            return future
+        coro = self._with_engine(lambda engine: self._cached_play(engine, board, limit))
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def play(self, board, limit=None, **kwargs):
+        return self.submit(board, limit, **kwargs).result()
+
+    async def _analyse(self, engine, board, limit, multipv=None, **kwargs):
+        #python-chess breaks the engine's command queue when an analysis is cancelled while
+        #it starts, so the start runs shielded and a cancelled analysis is stopped instead
+        start = asyncio.ensure_future(engine.analysis(board, limit, multipv=multipv, **kwargs))
+        try:
+            analysis = await asyncio.shield(start)
+        except asyncio.CancelledError:
+            (await start).stop()
+            raise
+        with analysis:
+            await analysis.wait()
+        return analysis.info if multipv is None else analysis.multipv
+
+    def submit_analyse(self, board, limit=None, **kwargs):
+        limit = limit or self.limit
+        board = board.copy(stack=False)
+        coro = self._with_engine(lambda engine: self._analyse(engine, board, limit, **kwargs))
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def analyse(self, board, limit=None, **kwargs):
+        return self.submit_analyse(board, limit, **kwargs).result()
+
+    def analyse_many(self, boards, limit=None, root_moves=None, deadline=None, **kwargs):
+        #yields (index, analysis) in completion order, the analysis being a list of infos
+        #with multipv. `limit` and `root_moves` are one value for every board or a list
+        #with one per board. rejected boards, the deadline and cancellation work as in play_many
+        futures = {}
+        for i, board in enumerate(boards):
+            board_limit = limit[i] if isinstance(limit, list) else limit
+            moves = root_moves[i] if root_moves and isinstance(root_moves[0], list) else root_moves
+            futures[self.submit_analyse(board, board_limit, root_moves=moves, **kwargs)] = i
+        try:
+            for future in _completed(futures, deadline):
+                try:
+                    result = future.result()
+                except (chess.engine.EngineError, chess.engine.EngineTerminatedError):
+                    result = None
+                yield futures[future], result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def play_many(self, boards, limit=None, deadline=None, **kwargs):
+        #yields (index, PlayResult) in completion order. boards the engine rejects are
+        #yielded with None. searches still running when the caller stops, or when the
+        #time.monotonic() deadline passes, are cancelled. boards are searched in the order
+        #given. with a cache, repeated positions in the batch share a single search.
+        #`limit` is one Limit for every board or a list with one per board
+        futures = {}
+        searches = {}
+        for i, board in enumerate(boards):
+            key = i if self.cache is None else chess.polyglot.zobrist_hash(board)
+            if key not in searches:
+                board_limit = limit[i] if isinstance(limit, list) else limit
+                searches[key] = self.submit(board, board_limit, **kwargs)
+            futures.setdefault(searches[key], []).append(i)
+        try:
+            for future in _completed(futures, deadline):
+                try:
+                    result = future.result()
+                except (chess.engine.EngineError, chess.engine.EngineTerminatedError):
+                    result = None
+                for i in futures[future]:
+                    yield i, result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def quit(self):
+        async def _quit():
+            if self._releasing:
+                await asyncio.wait(self._releasing, timeout=2)
+            for engine in self._engines:
+                try:
+                    await asyncio.wait_for(engine.quit(), 2)
+                except (asyncio.TimeoutError, chess.engine.EngineTerminatedError):
+                    pass
+        try:
+            self._run(_quit())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+
+def multipv_scores(board, infos, moves, color):
+    #centipawn score for `color` of each move on one board, from a MultiPV analysis.
+    #a move the board does not allow is scored as RBC would carry it out: as its revised
+    #move, or when there is none (no piece there, the move becomes a pass) as the worst line
+    scores = {}
+    for info in infos:
+        if info.get('pv') and 'score' in info:
+            scores[info['pv'][0]] = info['score'].pov(color).score(mate_score=MATE_SCORE)
+    if not scores:
+        return None
+    worst = min(scores.values())
+    row = []
+    for move in moves:
+        if move not in scores and board.piece_at(move.from_square) is not None:
+            move = revise_move(board, move)
+        row.append(scores.get(move, worst))
+    return row
+
+
+def choose_by_expected_score(engine, boards, weights, moves, color, limits, deadline=None):
+    #analyses every board with MultiPV restricted to `moves`, fills a boards x moves score
+    #matrix and returns the move with the best weighted mean score, None if nothing came back.
+    #what has come back by the time.monotonic() deadline decides, later searches are cancelled
+    root_moves = []
+    for board in boards:
+        legal = set(board.legal_moves)
+        root_moves.append([m for m in moves if m in legal])
+    todo = [i for i, roots in enumerate(root_moves) if roots]
+    matrix = np.full((len(boards), len(moves)), np.nan)
+    for j, infos in engine.analyse_many([boards[i] for i in todo], [limits[i] for i in todo],
+                                        [root_moves[i] for i in todo], deadline, multipv=len(moves)):
+        i = todo[j]
+        if infos is not None:
+            row = multipv_scores(boards[i], infos if isinstance(infos, list) else [infos], moves, color)
+            if row is not None:
+                matrix[i] = row
+    known = ~np.isnan(matrix[:, 0])
+    if not known.any():
+        return None
+    w = np.asarray(weights, dtype=np.float64)[known]
+    expected = w @ matrix[known] / w.sum()
+    return moves[int(np.argmax(expected))]
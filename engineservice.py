@@ -0,0 +1,255 @@
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import concurrent.futures
+from multiprocessing.managers import BaseManager
+from enginepool import EnginePool, EngineCache, STOCKFISH_PATH, POOL_SIZE, SEARCH_LIMIT, as_play_result, cacheable
+
+#environment variable holding the unix socket of a running service. when it is set,
+#open_engine connects to the service instead of starting stockfish processes of its own
+SERVICE_ENV = 'RBC_ENGINE_SERVICE'
+AUTHKEY = os.environ.get('RBC_ENGINE_SERVICE_KEY', 'rbc-engines').encode()
+
+
+class EngineService:
+    """
+    Warm Stockfish pool living in the service process, with one result cache for every
+    client. Stockfish's own hash cannot be shared between processes, so the shared cache
+    of finished searches stands in for it.
+    """
+
+    def __init__(self, size=POOL_SIZE, path=STOCKFISH_PATH):
+        self.cache = EngineCache()
+        self.pool = EnginePool(size, path, cache=self.cache)
+        #searches started by submit, by id, until their result is collected or they are cancelled
+        self._searches = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def size(self):
+        return self.pool.size
+
+    def _track(self, future):
+        with self._lock:
+            self._next_id += 1
+            self._searches[self._next_id] = future
+            return self._next_id
+
+    def submit(self, board, limit=None, **kwargs):
+        #starts a search and returns its id for result() or cancel()
+        return self._track(self.pool.submit(board, limit, **kwargs))
+
+    def submit_analyse(self, board, limit=None, **kwargs):
+        return self._track(self.pool.submit_analyse(board, limit, **kwargs))
+
+    def result(self, search_id):
+        with self._lock:
+            future = self._searches.get(search_id)
+        if future is None:
+            raise concurrent.futures.CancelledError()
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._searches.pop(search_id, None)
+
+    def cancel(self, search_id):
+        #stops the search on its engine, which goes back to the pool for other clients
+        with self._lock:
+            future = self._searches.pop(search_id, None)
+        if future is not None:
+            future.cancel()
+
+    def play(self, board, limit=None, **kwargs):
+        return self.pool.play(board, limit, **kwargs)
+
+    def analyse(self, board, limit=None, **kwargs):
+        return self.pool.analyse(board, limit, **kwargs)
+
+    def stats(self):
+        return {'size': self.pool.size, 'cached': len(self.cache), 'hits': self.cache.hits,
+                'misses': self.cache.misses, 'searches': len(self._searches)}
+
+    def quit(self):
+        self.pool.quit()
+
+
+class EngineManager(BaseManager):
+    pass
+
+
+class ServiceSearch(concurrent.futures.Future):
+    """
+    Future of a search run by the service. A client thread waits on the service for it, so
+    cancelling it once it runs also cancels the service's search, which frees the engine.
+    """
+
+    def __init__(self, service):
+        super().__init__()
+        self._service = service
+        self._search_id = None
+        self._abandoned = False
+        self._id_lock = threading.Lock()
+
+    def started(self, search_id):
+        with self._id_lock:
+            self._search_id = search_id
+            abandoned = self._abandoned
+        #cancelled while the search was being started
+        if abandoned:
+            self._service.cancel(search_id)
+
+    def cancel(self):
+        if super().cancel():
+            return True
+        with self._id_lock:
+            self._abandoned = True
+            search_id = self._search_id
+        if search_id is not None and not self.done():
+            self._service.cancel(search_id)
+        return False
+
+
+class EngineClient:
+    """
+    Stands in for EnginePool in the bots: the same play and analyse calls, single or many,
+    answered by the service. Each request runs on its own thread, so a client keeps every
+    engine of the service busy. A local cache, when given, is checked before asking.
+    """
+
+    def __init__(self, address, cache=None, limit=SEARCH_LIMIT):
+        EngineManager.register('engine')
+        manager = EngineManager(address=address, authkey=AUTHKEY)
+        manager.connect()
+        #proxies open one connection per calling thread, so the threads do not share one
+        self._service = manager.engine()
+        self.size = self._service.size()
+        self.cache = cache
+        self.limit = limit
+        self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.size)
+
+    def _run(self, future, start, board, limit, kwargs, cache):
+        #on a client thread: starts the search in the service and waits for its result
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            search_id = start(board, limit, **kwargs)
+            future.started(search_id)
+            result = self._service.result(search_id)
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        if cache:
+            self.cache.put(board, result, limit)
+        future.set_result(result)
+
+    def _submit(self, start, board, limit, kwargs, cache=False):
+        #`start` is the service's submit or submit_analyse, `cache` stores the result locally
+        future = ServiceSearch(self._service)
+        self._threads.submit(self._run, future, start, board, limit, kwargs, cache)
+        return future
+
+    def submit(self, board, limit=None, **kwargs):
+        limit = limit or self.limit
+        board = board.copy(stack=False)
+        cache = self.cache is not None and cacheable(kwargs)
+        if cache:
+            entry = self.cache.get(board, limit)
+            if entry is not None:
+                future = concurrent.futures.Future()
+                future.set_result(as_play_result(entry))
+                return future
+        return self._submit(self._service.submit, board, limit, kwargs, cache)
+
+    def play(self, board, limit=None, **kwargs):
+        return self.submit(board, limit, **kwargs).result()
+
+    def submit_analyse(self, board, limit=None, **kwargs):
+        return self._submit(self._service.submit_analyse, board.copy(stack=False), limit or self.limit, kwargs)
+
+    def analyse(self, board, limit=None, **kwargs):
+        return self.submit_analyse(board, limit, **kwargs).result()
+
+    #searches are spread as on a local pool. cancelling one the service is running stops it there
+    play_many = EnginePool.play_many
+    analyse_many = EnginePool.analyse_many
+
+    def quit(self):
+        #the engines belong to the service, only this client's threads stop
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+def open_engine(size=POOL_SIZE, path=STOCKFISH_PATH, cache=None, limit=SEARCH_LIMIT):
+    #the bots' way to get an engine: a client of the shared service when RBC_ENGINE_SERVICE
+    #names one, otherwise a pool of their own. read on each call, runners set it after import
+    address = os.environ.get(SERVICE_ENV)
+    if address:
+        return EngineClient(address, cache=cache, limit=limit)
+    return EnginePool(size, path, limit=limit, cache=cache)
+
+
+def serve(address, size=POOL_SIZE, path=STOCKFISH_PATH):
+    service = EngineService(size, path)
+    EngineManager.register('engine', callable=lambda: service)
+    manager = EngineManager(address=address, authkey=AUTHKEY)
+    server = manager.get_server()
+    #serve_forever only stops on KeyboardInterrupt, turn SIGTERM into one
+    signal.signal(signal.SIGTERM, lambda *args: signal.raise_signal(signal.SIGINT))
+    print(f"{service.size()} engines serving on {address}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        #the listener removes its socket file itself
+        service.quit()
+
+
+def is_serving(address):
+    try:
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(address)
+        return True
+    except OSError:
+        return False
+
+
+def start_service(address, size=POOL_SIZE, path=STOCKFISH_PATH, timeout=30):
+    #starts a service in the background for a tournament run, None if one is already up
+    if is_serving(address):
+        return None
+    if os.path.exists(address):
+        os.unlink(address)
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), address, '--engines', str(size),
+                             '--path', path])
+    deadline = time.monotonic() + timeout
+    while not is_serving(address):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise RuntimeError(f"engine service did not start on {address}")
+        time.sleep(0.1)
+    return proc
+
+
+def stop_service(proc):
+    if proc is not None:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Serves a warm pool of Stockfish engines over a unix socket. "
+                                                 "Bots use it when RBC_ENGINE_SERVICE is set to the socket path.")
+    parser.add_argument("address", help="unix socket path")
+    parser.add_argument("--engines", type=int, default=POOL_SIZE, help="stockfish processes")
+    parser.add_argument("--path", default=STOCKFISH_PATH, help="stockfish executable")
+    args = parser.parse_args()
+    serve(args.address, args.engines, args.path)
+
+
+if __name__ == "__main__":
+    main()
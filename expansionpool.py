@@ -0,0 +1,122 @@
+import os
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy as np
+from beliefs import BOARD_DTYPE, RESAMPLE_SLACK, BeliefStore
+
+#worker processes that expand beliefs, 0 or 1 expands in the agent's own process
+EXPANSION_WORKERS = int(os.environ.get('RBC_EXPANSION_WORKERS', 0))
+#parents per shard below which the round trip to a worker costs more than it saves
+MIN_SHARD = 100
+#shards per worker, so a worker that draws cheap parents picks up another shard
+SHARDS_PER_WORKER = 2
+
+#rows exchanged with the workers through shared memory, parents in and children out.
+#children come back with their zobrist key so the merge does not hash them again
+ROW_DTYPE = np.dtype([('board', BOARD_DTYPE), ('weight', np.float64), ('count', np.int64), ('key', np.uint64)])
+
+
+def _to_shared(rows):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, rows.nbytes))
+    np.ndarray(rows.shape, ROW_DTYPE, buffer=shm.buf)[:] = rows
+    return shm
+
+
+def _from_shared(name, n, start=0, stop=None, unlink=False):
+    #copies rows out of a block and detaches from it, removing it when it is done with
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.array(np.ndarray((n,), ROW_DTYPE, buffer=shm.buf)[start:stop])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _ready(_):
+    return os.getpid()
+
+
+def _expand_shard(name, n, start, stop, capture_square, limit, deadline, sense_result, slack):
+    #runs in a worker: expands parents[start:stop] and hands the children back in a new
+    #block, which the agent unlinks once it has read it, with their occupancy table
+    rows = _from_shared(name, n, start, stop)
+    parents = BeliefStore.from_arrays(rows['board'], rows['weight'], rows['count'])
+    children = parents.expand(capture_square, limit, deadline, sense_result, slack)
+    out = np.zeros(len(children), dtype=ROW_DTYPE)
+    out['board'] = children.data
+    out['weight'] = children.weights
+    out['count'] = children.counts
+    out['key'] = children.hashes()
+    shm = _to_shared(out)
+    shm.close()
+    return shm.name, len(out), children.occupancy()
+
+
+class ExpansionPool:
+    """
+    Persistent worker processes for the opponent-move expansion. Parents are split into
+    contiguous shards that go to the workers through one shared memory block; each shard
+    comes back deduplicated in its own block, and positions reached from parents in
+    different shards are merged here. Small belief sets are expanded in process.
+    """
+
+    def __init__(self, workers=EXPANSION_WORKERS):
+        self.workers = workers
+        self._executor = None
+        if workers > 1:
+            self._start()
+
+    def _start(self):
+        #spawned, the agents run engine threads that a forked child would inherit half-way
+        self._executor = concurrent.futures.ProcessPoolExecutor(self.workers,
+                                                                mp_context=multiprocessing.get_context('spawn'))
+        #every worker is started now rather than on the first exploded turn
+        list(self._executor.map(_ready, range(self.workers)))
+
+    def expand(self, store, capture_square, limit=None, deadline=None, sense_result=None, slack=RESAMPLE_SLACK):
+        #same result as store.expand, the resampling to `limit` done once after the merge
+        shards = min(self.workers * SHARDS_PER_WORKER, len(store) // MIN_SHARD)
+        if self.workers <= 1 or shards < 2:
+            return store.expand(capture_square, limit, deadline, sense_result, slack)
+        if self._executor is None:
+            self._start()
+
+        rows = np.zeros(len(store), dtype=ROW_DTYPE)
+        rows['board'] = store.data
+        rows['weight'] = store.weights
+        rows['count'] = store.counts
+        shm = _to_shared(rows)
+        try:
+            bounds = np.linspace(0, len(store), shards + 1).astype(int)
+            futures = [self._executor.submit(_expand_shard, shm.name, len(store), int(start), int(stop),
+                                             capture_square, limit, deadline, sense_result, slack)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            concurrent.futures.wait(futures)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        #every returned block is read and unlinked before a failed shard is reported
+        children, tables, error = [], [], None
+        for future in futures:
+            try:
+                name, n, occupancy = future.result()
+            except Exception as e:
+                error = e
+                continue
+            children.append(_from_shared(name, n, unlink=True))
+            tables.append(occupancy)
+        if error is not None:
+            raise error
+        rows = np.concatenate(children)
+        store = BeliefStore.from_arrays(rows['board'], rows['weight'], rows['count'])
+        store._occupancy = (sum(t[0] for t in tables), sum(t[1] for t in tables))
+        merged = store.merge(rows['key'])
+        return merged if limit is None else merged.resample(limit)
+
+    def quit(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import chess
+from reconchess import load_player, play_local_game, LocalGame
+from tournament import BOTS, double_round_robin, finished_ids, clock_used, shared_engines
+from instrument import instrumented
+
+#per worker process: one player instance per (bot, colour), reused game after game
+_players = {}
+#(trace_dir, profile_slowest) when the players' callbacks are traced
+_tracing = None
+
+
+def _init_worker(engines_per_match, trace_dir=None, profile_slowest=0):
+    #runs once per worker, before any bot module (and so enginepool) is imported
+    global _tracing
+    os.environ["RBC_ENGINE_POOL_SIZE"] = str(engines_per_match)
+    if trace_dir:
+        _tracing = (trace_dir, profile_slowest)
+    #pool workers leave through os._exit, which skips atexit; multiprocessing finalizers still run
+    Finalize(None, _close_players, exitpriority=10)
+
+
+def _close_players():
+    for player in _players.values():
+        close = getattr(player, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+    _players.clear()
+
+
+def _player(bot, color):
+    key = (bot, color)
+    if key not in _players:
+        _, cls = load_player(bot)
+        if _tracing is not None:
+            cls = instrumented(cls, *_tracing)
+        player = cls()
+        #bots that support it keep their engines alive between games
+        if hasattr(player, "keep_engine"):
+            player.keep_engine = True
+        _players[key] = player
+    return _players[key]
+
+
+def _drop_players(*keys):
+    #a game that raised may leave a player half updated, start the next one fresh
+    for key in keys:
+        player = _players.pop(key, None)
+        close = getattr(player, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def play_game(match, seconds_per_player=900, history_dir=None):
+    #plays one match inside a long-lived worker, handle_game_start resets the reused players
+    start = time.monotonic()
+    game = LocalGame(seconds_per_player)
+    white_key, black_key = (match["white"], chess.WHITE), (match["black"], chess.BLACK)
+    history = None
+    try:
+        white, black = _player(*white_key), _player(*black_key)
+        winner_color, win_reason, history = play_local_game(white, black, game=game)
+        winner = 'draw' if winner_color is None else chess.COLOR_NAMES[winner_color]
+        reason = win_reason.name if win_reason is not None else None
+    except Exception:
+        traceback.print_exc()
+        _drop_players(white_key, black_key)
+        if game.current_turn_start_time is not None:
+            game.end()
+            history = game.get_game_history()
+        winner, reason = 'error', traceback.format_exc(limit=1).strip().splitlines()[-1]
+
+    record = {
+        "id": match["id"],
+        "white": match["white"],
+        "black": match["black"],
+        "winner": winner,
+        "reason": reason,
+        "duration": round(time.monotonic() - start, 3),
+        "white_clock_used": round(clock_used(game, history, chess.WHITE), 3),
+        "black_clock_used": round(clock_used(game, history, chess.BLACK), 3),
+        "turns": history.num_turns() if history is not None else 0,
+        "worker": os.getpid(),
+    }
+    if history_dir and history is not None:
+        os.makedirs(history_dir, exist_ok=True)
+        path = os.path.join(history_dir, f"{match['id'].replace('/', '_').replace('|', '-')}.json")
+        history.save(path)
+        record["history"] = path
+    return record
+
+
+def run_in_process(matches, results_path="results.jsonl", workers=None, seconds_per_player=900,
+                   history_dir=None, engines_per_match=1, retry_errors=True, trace_dir=None, profile_slowest=0,
+                   engine_service=None):
+    #same results file and resume rules as tournament.run_tournament, but games are played
+    #by `workers` long-lived processes, so interpreters, imports and engines are paid once
+    done = finished_ids(results_path, retry_errors)
+    pending = [m for m in matches if m["id"] not in done]
+    workers = workers or os.cpu_count() or 1
+    print(f"{len(matches) - len(pending)} of {len(matches)} matches already played, {len(pending)} to go")
+
+    service = shared_engines(engine_service)
+    try:
+        with open(results_path, "a") as out, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                    initargs=(engines_per_match, trace_dir, profile_slowest)) as pool:
+            futures = [pool.submit(play_game, m, seconds_per_player, history_dir) for m in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                print(f"{record['white']} (White) vs {record['black']} (Black): {record['winner']} ({record['reason']})")
+    finally:
+        if service is not None:
+            from engineservice import stop_service
+            stop_service(service)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("bots", nargs="*", default=BOTS, help="bot source files or modules")
+    parser.add_argument("--results", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--repeats", type=int, default=2, help="rounds per pairing, each with both colours")
+    parser.add_argument("--seconds-per-player", type=float, default=900)
+    parser.add_argument("--engines-per-match", type=int, default=1, help="stockfish processes per bot")
+    parser.add_argument("--history-dir", default=None, help="save each game's history here")
+    parser.add_argument("--no-retry-errors", action="store_true", help="do not replay matches that errored")
+    parser.add_argument("--trace-dir", default=None, help="write a JSONL callback trace per player and game here")
+    parser.add_argument("--profile-slowest", type=int, default=0,
+                        help="with --trace-dir, save cProfile stats of this many slowest callbacks per game")
+    parser.add_argument("--engine-service", metavar="SOCKET", default=None,
+                        help="share one engine service at this unix socket, started if not running")
+    args = parser.parse_args()
+
+    run_in_process(double_round_robin(args.bots, args.repeats), args.results, args.workers,
+                   args.seconds_per_player, args.history_dir, args.engines_per_match,
+                   not args.no_retry_errors, args.trace_dir, args.profile_slowest, args.engine_service)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import cProfile
+import heapq
+import json
+import os
+import time
+import tracemalloc
+import chess
+from memorybudget import peak_rss_bytes, reset_peak_rss
+
+#the Player callbacks that get timed
+CALLBACKS = ("handle_game_start", "handle_opponent_move_result", "choose_sense", "handle_sense_result",
+             "choose_move", "handle_move_result", "handle_game_end")
+
+
+class EngineProbe:
+    """Wraps an engine or EnginePool, counting searches and the wall time spent in them."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def _timed(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.calls += 1
+            self.seconds += time.perf_counter() - start
+
+    def play(self, *args, **kwargs):
+        return self._timed(self.engine.play, *args, **kwargs)
+
+    def analyse(self, *args, **kwargs):
+        return self._timed(self.engine.analyse, *args, **kwargs)
+
+    def submit(self, *args, **kwargs):
+        #asynchronous, only the call is counted
+        self.calls += 1
+        return self.engine.submit(*args, **kwargs)
+
+    def submit_analyse(self, *args, **kwargs):
+        self.calls += 1
+        return self.engine.submit_analyse(*args, **kwargs)
+
+    def play_many(self, *args, **kwargs):
+        return self._timed_many(self.engine.play_many(*args, **kwargs))
+
+    def analyse_many(self, *args, **kwargs):
+        return self._timed_many(self.engine.analyse_many(*args, **kwargs))
+
+    def _timed_many(self, results):
+        #time is counted while the caller waits for the next result, not while it handles one
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(results)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds += time.perf_counter() - start
+                self.calls += 1
+                yield item
+        finally:
+            results.close()
+
+
+class InstrumentedMixin:
+    """
+    Records every callback of the Player it is mixed into: wall time, belief count before
+    and after, engine searches, cache hits and peak memory, with the turn's peak on its
+    handle_move_result record. One JSONL trace is written per game, and with profile_slowest
+    > 0 the slowest callbacks are also saved as cProfile .prof files. Peak traced memory is
+    added when tracemalloc is tracing.
+    """
+
+    trace_dir = "traces"
+    profile_slowest = 0
+
+    def _trace_open(self, color, opponent_name):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        name = f"{type(self).__name__}-{chess.COLOR_NAMES[color]}-{opponent_name}-{int(time.time() * 1000)}"
+        self._trace_name = os.path.join(self.trace_dir, name)
+        self._trace_file = open(self._trace_name + ".jsonl", "w")
+        self._trace_turn = 0
+        self._trace_turn_peaks = {}
+        self._trace_slowest = []
+
+    def _trace_close(self):
+        for _, turn, callback, stats in sorted(self._trace_slowest, key=lambda x: (x[1], x[2])):
+            stats.dump_stats(f"{self._trace_name}-turn{turn}-{callback}.prof")
+        self._trace_slowest = []
+        self._trace_file.close()
+        self._trace_file = None
+
+    def _trace_engine(self):
+        #agents may replace their engine between games, so the probe is put back when missing
+        engine = getattr(self, "engine", None)
+        if engine is None:
+            return None
+        if not isinstance(engine, EngineProbe):
+            engine = self.engine = EngineProbe(engine)
+        return engine
+
+    def _trace_beliefs(self):
+        beliefs = getattr(self, "possible_boards", None)
+        return None if beliefs is None else len(beliefs)
+
+    def _trace_cache(self):
+        cache = getattr(self, "engine_cache", None)
+        return (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    def _trace_call(self, callback, method, *args, **kwargs):
+        if callback == "handle_game_start":
+            if getattr(self, "_trace_file", None) is not None:
+                self._trace_close()
+            self._trace_open(args[0], args[2])
+
+        engine = self._trace_engine()
+        calls, engine_seconds = (engine.calls, engine.seconds) if engine is not None else (0, 0.0)
+        hits, misses = self._trace_cache()
+        beliefs_before = self._trace_beliefs()
+        profile = cProfile.Profile() if self.profile_slowest else None
+        #peaks are per callback, a turn's peak is the largest of its records
+        reset_peak_rss()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            engine = self._trace_engine()
+            hits_after, misses_after = self._trace_cache()
+            record = {
+                "turn": self._trace_turn,
+                "callback": callback,
+                "seconds": round(seconds, 6),
+                "beliefs_before": beliefs_before,
+                "beliefs_after": self._trace_beliefs(),
+                "engine_calls": engine.calls - calls if engine is not None else 0,
+                "engine_seconds": round(engine.seconds - engine_seconds, 6) if engine is not None else 0.0,
+                "cache_hits": hits_after - hits,
+                "cache_misses": misses_after - misses,
+                "peak_rss_mib": _mib(peak_rss_bytes()),
+            }
+            if tracemalloc.is_tracing():
+                record["traced_peak_mib"] = _mib(tracemalloc.get_traced_memory()[1])
+            #the turn's peak so far, written on the record that ends the turn
+            peaks = self._trace_turn_peaks
+            for key in ("peak_rss_mib", "traced_peak_mib"):
+                if record.get(key) is not None:
+                    peaks[key] = max(peaks.get(key, 0.0), record[key])
+            if callback == "handle_move_result":
+                for key, peak in peaks.items():
+                    record["turn_" + key] = peak
+            memory = getattr(self, "memory", None)
+            if memory is not None and memory.headroom is not None:
+                record["headroom_mib"] = _mib(memory.headroom)
+            self._trace_file.write(json.dumps(record) + "\n")
+            self._trace_file.flush()
+
+            if profile is not None:
+                entry = (seconds, self._trace_turn, callback, profile)
+                if len(self._trace_slowest) < self.profile_slowest:
+                    heapq.heappush(self._trace_slowest, entry)
+                elif seconds > self._trace_slowest[0][0]:
+                    heapq.heapreplace(self._trace_slowest, entry)
+            if callback == "handle_move_result":
+                self._trace_turn += 1
+                self._trace_turn_peaks = {}
+            elif callback == "handle_game_end":
+                self._trace_close()
+
+
+def _mib(n):
+    return None if n is None else round(n / 2 ** 20, 2)
+
+
+def instrumented(player_class, trace_dir="traces", profile_slowest=0):
+    #returns a subclass of player_class with every callback traced, the bot's code is untouched
+    namespace = {"trace_dir": trace_dir, "profile_slowest": profile_slowest}
+    cls = type(f"Instrumented{player_class.__name__}", (InstrumentedMixin, player_class), namespace)
+    for callback in CALLBACKS:
+        setattr(cls, callback, _make_traced(cls, callback))
+    return cls
+
+
+def _make_traced(cls, callback):
+    def method(self, *args, **kwargs):
+        return self._trace_call(callback, getattr(super(cls, self), callback), *args, **kwargs)
+    method.__name__ = callback
+    return method
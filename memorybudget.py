@@ -0,0 +1,115 @@
+import os
+from beliefs import RESAMPLE_SLACK
+
+#share of the machine's available memory one player lets its beliefs grow into
+MEMORY_FRACTION = float(os.environ.get('RBC_MEMORY_FRACTION', 0.25))
+#ceiling on the player's resident size in MiB, for several bots sharing a machine. 0 is none
+MEMORY_LIMIT_MB = int(os.environ.get('RBC_MEMORY_LIMIT_MB', 0))
+#most the beliefs may take in MiB when the headroom allows it, above the budget's own max_bytes
+MEMORY_MAX_MB = int(os.environ.get('RBC_MEMORY_MAX_MB', 512))
+#the expansion dict is thinned at least this far past the budget, or it would thin every few children
+MIN_RESAMPLE_SLACK = 1.25
+
+
+def _page_size():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _proc_status(field):
+    #a kB field of /proc/self/status in bytes, None off linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    #None off linux
+    page = _page_size()
+    if page is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * page
+    except OSError:
+        return None
+
+
+def peak_rss_bytes():
+    #high water mark of the resident size since the last reset_peak_rss
+    return _proc_status('VmHWM')
+
+
+def reset_peak_rss():
+    #linux lets a process restart its own high water mark, elsewhere the peak is since start
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def available_bytes():
+    #memory the system can hand out without swapping
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    page = _page_size()
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * page if page is not None else None
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class MemoryGovernor:
+    """
+    Sizes a ParticleBudget from live memory rather than a constant. Each turn the headroom
+    is read off the process's resident size and the system's available memory; the budget's
+    max_bytes follows it up to max_mb (or down to whatever fits), and the expansion's
+    resampling slack shrinks once the headroom falls under the max_bytes the budget was built
+    with. Expansion workers each hold their own dict, so the headroom is split between them.
+    """
+
+    def __init__(self, particles, fraction=MEMORY_FRACTION, limit_mb=MEMORY_LIMIT_MB, max_mb=MEMORY_MAX_MB,
+                 processes=1):
+        self.particles = particles
+        self.base = particles.max_bytes
+        #0 keeps the budget's own max_bytes as the ceiling
+        self.ceiling = max(self.base, max_mb * 2 ** 20) if max_mb else self.base
+        self.fraction = fraction
+        self.limit = limit_mb * 2 ** 20 if limit_mb else None
+        self.processes = max(1, processes)
+        self.headroom = None
+
+    def sample(self):
+        #bytes the beliefs may still grow by, None when the platform does not say
+        headrooms = []
+        available = available_bytes()
+        if available is not None:
+            headrooms.append(available * self.fraction)
+        rss = rss_bytes()
+        if self.limit is not None and rss is not None:
+            headrooms.append(self.limit - rss)
+        return max(0, int(min(headrooms))) if headrooms else None
+
+    def update(self):
+        #called as the turn starts, before the expansion is sized
+        self.headroom = self.sample()
+        if self.headroom is None:
+            return
+        share = self.headroom // self.processes
+        self.particles.max_bytes = min(self.ceiling, share)
+        #plenty of room keeps the full slack, less room thins the expansion sooner
+        room = min(1.0, share / max(1, self.base))
+        self.particles.slack = max(MIN_RESAMPLE_SLACK, 1 + (RESAMPLE_SLACK - 1) * room)
@@ -20,10 +20,12 @@ def apply_move(fen, move_uci):
         return "Illegal move"
     
 
-#user input
-fen = input()
-move_uci = input()
+if __name__ == "__main__":
 
-# post-move and the fen string output
-resulting_fen = apply_move(fen, move_uci)
-print(resulting_fen)
+    #user input
+    fen = input()
+    move_uci = input()
+
+    # post-move and the fen string output
+    resulting_fen = apply_move(fen, move_uci)
+    print(resulting_fen)
@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import os
+import chess
+import numpy as np
+from reconchess.utilities import move_actions, revise_move, capture_square_of_move
+from beliefs import BOARD_DTYPE, BeliefStore, rbc_moves, capture_square_of, window_squares
+
+#where the agents look for the book, built offline with `python openings.py`
+BOOK_PATH = os.environ.get('RBC_OPENING_BOOK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openings'))
+
+#the beliefs of every book position, back to back
+ENTRY_DTYPE = np.dtype([('board', BOARD_DTYPE), ('weight', np.float64), ('count', np.int64)])
+#one row per book position, sorted by key: its rows in the entries file and the square to sense
+INDEX_DTYPE = np.dtype([('key', np.uint64), ('start', np.int64), ('stop', np.int64), ('sense', np.int8)])
+
+#clock the builder reports to the agent, enough that no time budget cuts a callback short
+BUILD_CLOCK = 1e6
+
+
+def opponent_observation(capture_square):
+    return ('opponent', capture_square)
+
+
+def sense_observation(sense_result):
+    #sorted, the referee and window_squares list the window in different orders
+    return ('sense', tuple(sorted((sq, piece.symbol() if piece else None) for sq, piece in sense_result)))
+
+
+def move_observation(requested_move, taken_move, capture_square):
+    return ('move', requested_move.uci() if requested_move else None, taken_move.uci() if taken_move else None,
+            capture_square)
+
+
+def book_key(color, observations):
+    #stable 64 bit key of everything the referee has told one side so far
+    digest = hashlib.blake2b(repr((bool(color), tuple(observations))).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class OpeningBook:
+    """
+    Precomputed early-game beliefs. Positions are keyed by the observations that lead to
+    them, each holding the belief set after the opponent's move and the square to sense.
+    Both files are memory-mapped, so a lookup is a binary search and a small copy.
+    """
+
+    def __init__(self, entries, index):
+        self.entries = entries
+        self.index = index
+
+    @classmethod
+    def load(cls, path=BOOK_PATH):
+        #None when no book has been built
+        if not os.path.exists(os.path.join(path, 'index.npy')):
+            return None
+        return cls(np.load(os.path.join(path, 'entries.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'index.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, color, observations):
+        #(BeliefStore, sense square) for a book position, or None
+        key = np.uint64(book_key(color, observations))
+        i = int(np.searchsorted(self.index['key'], key))
+        if i == len(self.index) or self.index['key'][i] != key:
+            return None
+        row = self.index[i]
+        rows = np.array(self.entries[row['start']:row['stop']])
+        store = BeliefStore.from_arrays(rows['board'].copy(), rows['weight'].copy(), rows['count'].copy())
+        return store, int(row['sense'])
+
+    def cursor(self, color):
+        return BookCursor(self, color)
+
+
+class BookCursor:
+    """Follows one game through the book, until the first observation the book does not hold."""
+
+    def __init__(self, book, color):
+        self.book = book
+        self.color = color
+        self.observations = []
+        self.sense = None
+
+    @property
+    def active(self):
+        return self.observations is not None
+
+    def opponent_moved(self, capture_square):
+        #the book position reached by the opponent's move, or None once out of book
+        if not self.active:
+            return None
+        self.observations.append(opponent_observation(capture_square))
+        entry = self.book.lookup(self.color, self.observations)
+        if entry is None:
+            self.observations = None
+            self.sense = None
+            return None
+        beliefs, self.sense = entry
+        return beliefs
+
+    def sensed(self, sense_result):
+        if self.active:
+            self.observations.append(sense_observation(sense_result))
+
+    def moved(self, requested_move, taken_move, capture_square):
+        if self.active:
+            self.observations.append(move_observation(requested_move, taken_move, capture_square))
+
+
+def _capture_outcomes(parents, color):
+    #every capture report the opponent's move can produce
+    outcomes = {None}
+    for board in parents.with_turn(not color):
+        outcomes.update(capture_square_of(board, move) for move in rbc_moves(board))
+    return sorted(outcomes, key=lambda sq: -1 if sq is None else sq)
+
+
+def _sense_outcomes(beliefs, square):
+    outcomes = {}
+    for board in beliefs:
+        result = [(sq, board.piece_at(sq)) for sq in window_squares(square)]
+        outcomes.setdefault(sense_observation(result), result)
+    return list(outcomes.values())
+
+
+def _move_outcomes(beliefs, move):
+    #(requested, taken, capture square) for every board on which our book move can be asked for
+    outcomes = {}
+    for board in beliefs:
+        if move not in move_actions(board):
+            continue
+        taken = revise_move(board, move)
+        capture_square = capture_square_of_move(board, taken)
+        outcomes.setdefault(move_observation(move, taken, capture_square), (move, taken, capture_square))
+    return list(outcomes.values())
+
+
+def build_book(agent, color, turns):
+    #walks every observation sequence of the agent's opening line for `turns` of our turns,
+    #updating beliefs with the agent's own callbacks so the book matches what it would compute
+    positions = []
+    #the book stores the beliefs after the opponent's move, so they must be expanded right away
+    agent.lazy_expansion = False
+    agent.handle_game_start(color, chess.Board(), 'book')
+    opening = agent.opening_moves[color]
+
+    def visit(parents, observations, turn):
+        for capture_square in _capture_outcomes(parents, color):
+            agent.possible_boards = parents
+            agent.clock.seconds_left = BUILD_CLOCK
+            agent.handle_opponent_move_result(capture_square is not None, capture_square)
+            beliefs = agent.possible_boards
+            if not len(beliefs):
+                continue
+            seen = observations + [opponent_observation(capture_square)]
+            sense = agent.choose_sense(list(chess.SQUARES), [], BUILD_CLOCK)
+            positions.append((book_key(color, seen), beliefs, sense))
+            if turn + 1 >= turns or turn >= len(opening):
+                continue
+            for sense_result in _sense_outcomes(beliefs, sense):
+                agent.possible_boards = beliefs
+                agent.handle_sense_result(sense_result)
+                sensed = agent.possible_boards
+                for requested, taken, our_capture in _move_outcomes(sensed, opening[turn]):
+                    agent.possible_boards = sensed
+                    agent.handle_move_result(requested, taken, our_capture is not None, our_capture)
+                    visit(agent.possible_boards, seen + [sense_observation(sense_result),
+                                                         move_observation(requested, taken, our_capture)], turn + 1)
+
+    visit(BeliefStore([chess.Board()]), [], 0)
+    return positions
+
+
+def save_book(positions, path=BOOK_PATH):
+    positions = sorted(positions, key=lambda p: p[0])
+    entries = np.zeros(sum(len(beliefs) for _, beliefs, _ in positions), dtype=ENTRY_DTYPE)
+    index = np.zeros(len(positions), dtype=INDEX_DTYPE)
+    start = 0
+    for i, (key, beliefs, sense) in enumerate(positions):
+        stop = start + len(beliefs)
+        entries['board'][start:stop] = beliefs.data
+        entries['weight'][start:stop] = beliefs.weights
+        entries['count'][start:stop] = beliefs.counts
+        index[i] = (key, start, stop, sense)
+        start = stop
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'entries.npy'), entries)
+    np.save(os.path.join(path, 'index.npy'), index)
+    return entries, index
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Builds the opening book ImprovedAgent reads during its first turns.")
+    parser.add_argument("--turns", type=int, default=4, help="our turns covered by the book, per colour")
+    parser.add_argument("--out", default=BOOK_PATH, help="directory the book is written to")
+    args = parser.parse_args()
+
+    #the builder never searches, the agent is created without engines
+    from benchmark import stub_engines
+    from ImprovedAgent import ImprovedAgent
+    with stub_engines(ImprovedAgent):
+        agent = ImprovedAgent()
+        agent.book = None
+        positions = []
+        for color in chess.COLORS:
+            found = build_book(agent, color, args.turns)
+            print(f"{chess.COLOR_NAMES[color]}: {len(found)} positions, {sum(len(b) for _, b, _ in found)} boards")
+            positions += found
+    entries, index = save_book(positions, args.out)
+    print(f"{len(index)} positions, {entries.nbytes / 2 ** 20:.1f} MiB written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,10 +16,12 @@ def nextstatepredictionwithcaptures(fen, capturesquarestring):
     return sorted(capturestates)
 
 
-str=input()
-square=input()
-for fen in nextstatepredictionwithcaptures(str, square):
-    print(fen)
+if __name__ == "__main__":
+
+    str=input()
+    square=input()
+    for fen in nextstatepredictionwithcaptures(str, square):
+        print(fen)
 
 
 #k1n1n3/p2p1p2/P2P1P2/8/8/8/8/7K b - - 23 30
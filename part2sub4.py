@@ -1,45 +1,40 @@
 import chess
+from beliefs import BeliefStore
 
-def is_board_consistent_with_window(board, windowdesc):
-    entries = windowdesc.strip().split(';')
-    for entry in entries:
+#turns "c8:?;d7:n;..." into a sense result list of (square, piece or None)
+def parsewindow(windowdesc):
+    senseresult = []
+    for entry in windowdesc.strip().split(';'):
         if not entry:
             continue
         squarestr, expected = entry.split(':')
-        squareindex = chess.parse_square(squarestr)
-        piece = board.piece_at(squareindex)
-
-        if piece:
-            actual = piece.symbol()
-        else:
-            actual='?'
-
-        if actual != expected:
-            return False
-    return True
+        piece = None if expected == '?' else chess.Piece.from_symbol(expected)
+        senseresult.append((chess.parse_square(squarestr), piece))
+    return senseresult
 
 #filters a list of FEN strings,returning only those boards that matchthe given sensing window
+#all boards are checked at once against the window bitboards
 def filterconsistentstates(fenlist, windowdesc):
-    consistent=[]
-    for fen in fenlist:
-        board=chess.Board(fen)
-        if is_board_consistent_with_window(board, windowdesc):
-            consistent.append(fen)
+    store = BeliefStore.from_fens(fenlist)
+    mask = store.consistent_with(parsewindow(windowdesc))
+    consistent = [fen for fen, ok in zip(fenlist, mask) if ok]
     return sorted(consistent)
 
 
         
-N = int(input())
-    
-fenstr = []
-for y in range(N):
-    fenstr.append(input())
+if __name__ == "__main__":
+
+    N = int(input())
         
-#the sensing window
-window=input()
-result=filterconsistentstates(fenstr, window)
-for i in result:
-    print(i)
+    fenstr = []
+    for y in range(N):
+        fenstr.append(input())
+            
+    #the sensing window
+    window=input()
+    result=filterconsistentstates(fenstr, window)
+    for i in result:
+        print(i)
 
  
 
@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import random
+import sys
+import time
+from collections import defaultdict
+import chess
+import chess.engine
+import numpy as np
+from reconchess import load_player, GameHistory
+from reconchess.utilities import move_actions
+from benchmark import stub_engines
+from instrument import instrumented
+from timebudget import TimeBudget, FixedClock
+
+
+def opponent_capture(history, turn):
+    #what handle_opponent_move_result was told at the start of `turn`
+    previous = turn.previous
+    if previous.turn_number < 0 or not history.has_move(previous):
+        return None
+    return history.capture_square(previous)
+
+
+@contextlib.contextmanager
+def fixed_clocks(player_class):
+    #the bots build their TimeBudget in __init__ and handle_game_start, so the class imported
+    #by the bot's module is swapped for FixedClock meanwhile
+    module = sys.modules[player_class.__module__]
+    if getattr(module, "TimeBudget", None) is not TimeBudget:
+        yield
+        return
+    module.TimeBudget = FixedClock
+    try:
+        yield
+    finally:
+        module.TimeBudget = TimeBudget
+
+
+class Replay:
+    """
+    Feeds one side of a saved game to a player: the same opponent move results, sense
+    results and move results the referee gave it, whatever the player chooses. Choices
+    that differ from the recorded ones are counted, timings are kept per callback.
+    """
+
+    def __init__(self, history, player, color, seconds_per_player=900, increment=5, fixed_clock=None):
+        self.history = history
+        self.player = player
+        self.color = color
+        self.seconds_left = seconds_per_player
+        self.increment = increment
+        self.fixed_clock = fixed_clock
+        self.timings = defaultdict(list)
+        self.diverged = []
+
+    def _call(self, callback, *args):
+        start = time.perf_counter()
+        try:
+            return getattr(self.player, callback)(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[callback].append(elapsed)
+            self.seconds_left -= elapsed
+
+    def _clock(self):
+        return self.fixed_clock if self.fixed_clock is not None else self.seconds_left
+
+    def play_turn(self, turn):
+        history = self.history
+        capture_square = opponent_capture(history, turn)
+        self._call("handle_opponent_move_result", capture_square is not None, capture_square)
+
+        truth = history.truth_board_before_move(turn)
+        moves = move_actions(truth)
+        if history.has_sense(turn):
+            sense = self._call("choose_sense", list(chess.SQUARES), moves, self._clock())
+            if sense != history.sense(turn):
+                self.diverged.append((turn.turn_number, "sense", sense, history.sense(turn)))
+            self._call("handle_sense_result", history.sense_result(turn))
+
+        if history.has_move(turn):
+            move = self._call("choose_move", moves, self._clock())
+            if move != history.requested_move(turn):
+                self.diverged.append((turn.turn_number, "move", move, history.requested_move(turn)))
+            capture = history.capture_square(turn)
+            self._call("handle_move_result", history.requested_move(turn), history.taken_move(turn),
+                       capture is not None, capture)
+        self.seconds_left += self.increment
+
+    def run(self, opponent_name="replay", last_turn=None):
+        self._call("handle_game_start", self.color, chess.Board(), opponent_name)
+        for turn in self.history.turns(self.color):
+            if last_turn is not None and turn.turn_number > last_turn:
+                return
+            self.play_turn(turn)
+        self._call("handle_game_end", self.history.get_winner_color(), self.history.get_win_reason(),
+                   self.history)
+
+
+def replay(history_path, bot, color, seed=0, stub_engine=False, last_turn=None, fixed_clock=None,
+           trace_dir=None, profile_slowest=0):
+    history = GameHistory.from_file(history_path)
+    _, bot_class = load_player(bot)
+    cls = instrumented(bot_class, trace_dir, profile_slowest) if trace_dir else bot_class
+    random.seed(seed)
+    np.random.seed(seed)
+
+    names = {chess.WHITE: history.get_white_player_name(), chess.BLACK: history.get_black_player_name()}
+    engines = stub_engines(bot_class) if stub_engine else contextlib.nullcontext()
+    #with a fixed clock the bot's time budgets no longer read the wall clock either
+    clocks = fixed_clocks(bot_class) if fixed_clock is not None else contextlib.nullcontext()
+    with engines, clocks:
+        player = cls()
+        game = Replay(history, player, color, fixed_clock=fixed_clock)
+        try:
+            game.run(names[not color], last_turn)
+        finally:
+            #a replay stopped early never reaches handle_game_end
+            close = getattr(player, "close", None)
+            if close is not None and last_turn is not None:
+                close()
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("history", help="GameHistory JSON, as saved by tournament.py --history-dir")
+    parser.add_argument("bot", help="bot source file or module")
+    parser.add_argument("--color", choices=["white", "black"], default="white", help="side the bot replays")
+    parser.add_argument("--seed", type=int, default=0, help="seed for random and numpy.random")
+    parser.add_argument("--stub-engine", action="store_true", help="answer searches instantly instead of stockfish")
+    parser.add_argument("--last-turn", type=int, default=None, help="stop after this turn number")
+    parser.add_argument("--fixed-clock", type=float, default=None,
+                        help="report this many seconds left every turn and stop the bot's clock within turns, "
+                             "so its time budgets do not depend on speed")
+    parser.add_argument("--trace-dir", default=None, help="write a JSONL callback trace here")
+    parser.add_argument("--profile-slowest", type=int, default=0)
+    args = parser.parse_args()
+
+    color = chess.WHITE if args.color == "white" else chess.BLACK
+    game = replay(args.history, args.bot, color, args.seed, args.stub_engine, args.last_turn, args.fixed_clock,
+                  args.trace_dir, args.profile_slowest)
+    for callback, times in game.timings.items():
+        print(f"{callback:28} {len(times):4d} calls {sum(times):9.3f}s total {max(times):8.3f}s max")
+    for turn_number, kind, chosen, recorded in game.diverged:
+        print(f"turn {turn_number}: {kind} {chosen} (recorded {recorded})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from functools import lru_cache
+import numpy as np
+import chess
+from beliefs import piece_index
+
+#share of the belief weight on which a king capture is played without searching
+DECISIVE_FRACTION = 0.5
+
+PROMOTIONS = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)
+
+
+def king_captures(board, legal=False):
+    #moves of the side to move that take the enemy king, read off the attack bitboards.
+    #listed in the order python-chess generates moves: pieces, then pawns, each from the
+    #highest square down. with legal=True moves python-chess would call illegal are dropped
+    king = board.king(not board.turn)
+    if king is None:
+        return []
+    attackers = board.attackers_mask(board.turn, king)
+    pawns = attackers & board.pawns
+    moves = [chess.Move(from_square, king) for from_square in chess.scan_reversed(attackers & ~pawns)]
+    for from_square in chess.scan_reversed(pawns):
+        if chess.BB_SQUARES[king] & chess.BB_BACKRANKS:
+            moves.extend(chess.Move(from_square, king, promotion) for promotion in PROMOTIONS)
+        else:
+            moves.append(chess.Move(from_square, king))
+    if legal:
+        moves = [move for move in moves if board.is_legal(move)]
+    return moves
+
+
+@lru_cache(maxsize=None)
+def _capture_rule(piece_type, color, move):
+    #whether a piece of this type on the move's from square attacks its to square on an
+    #empty board, and the squares that must be empty between them
+    from_square, to_square = move.from_square, move.to_square
+    to_bb = chess.BB_SQUARES[to_square]
+    if piece_type == chess.PAWN:
+        promotes = bool(to_bb & chess.BB_BACKRANKS)
+        return bool(chess.BB_PAWN_ATTACKS[color][from_square] & to_bb) and promotes == (move.promotion is not None), 0
+    if move.promotion is not None:
+        return False, 0
+    if piece_type == chess.KNIGHT:
+        return bool(chess.BB_KNIGHT_ATTACKS[from_square] & to_bb), 0
+    if piece_type == chess.KING:
+        return bool(chess.BB_KING_ATTACKS[from_square] & to_bb), 0
+    lines = 0
+    if piece_type in (chess.BISHOP, chess.QUEEN):
+        lines |= chess.BB_DIAG_ATTACKS[from_square][0]
+    if piece_type in (chess.ROOK, chess.QUEEN):
+        lines |= chess.BB_RANK_ATTACKS[from_square][0] | chess.BB_FILE_ATTACKS[from_square][0]
+    return bool(lines & to_bb), chess.between(from_square, to_square)
+
+
+def king_capture_fractions(store, move_actions, color):
+    #for each move, the share of the belief weight in which it takes the enemy king.
+    #RBC rules: pins and checks do not matter, the king is simply captured
+    fractions = dict.fromkeys(move_actions, 0.0)
+    table, total = store.occupancy()
+    if total <= 0:
+        return fractions
+    king = piece_index(chess.KING, not color)
+    #the occupancy table rules out most moves before any board is looked at
+    moves = [move for move in move_actions if table[king, move.to_square] > 0]
+    if not moves:
+        return fractions
+    pieces = store.data['pieces']
+    occupied = np.bitwise_or.reduce(pieces, axis=1)
+    their_king = pieces[:, king]
+    for move in moves:
+        hits = (their_king & np.uint64(chess.BB_SQUARES[move.to_square])) != 0
+        from_bb = np.uint64(chess.BB_SQUARES[move.from_square])
+        reach = np.zeros(len(store), dtype=bool)
+        for piece_type in chess.PIECE_TYPES:
+            attacks, between = _capture_rule(piece_type, color, move)
+            if not attacks:
+                continue
+            ok = (pieces[:, piece_index(piece_type, color)] & from_bb) != 0
+            if between:
+                ok &= (occupied & np.uint64(between)) == 0
+            reach |= ok
+        fractions[move] = float(store.weights[hits & reach].sum() / total)
+    return fractions
+
+
+def decisive_king_capture(store, move_actions, color, threshold=DECISIVE_FRACTION):
+    #the king capture to play without searching, or None when no move reaches the threshold
+    fractions = king_capture_fractions(store, move_actions, color)
+    move, fraction = max(fractions.items(), key=lambda x: x[1], default=(None, 0.0))
+    return move if fraction > 0 and fraction >= threshold else None
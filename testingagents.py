@@ -1,4 +1,4 @@
-import subprocess
+from tournament import run_tournament
 
 # List of bots (paths or module names)
 bots = [
@@ -12,11 +12,5 @@ bots = [
 
 print("Starting Tournament\n")
 
-for i, (white, black) in enumerate(bots, 1):
-    print(f"\n--- Match {i}: {white} (White) vs {black} (Black) ---")
-    try:
-        subprocess.run([
-            "python", "-m", "reconchess.scripts.rc_bot_match", white, black
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f" Error running match {i}: {e}")
+matches = [{"id": f"{white}|{black}|{i}", "white": white, "black": black} for i, (white, black) in enumerate(bots, 1)]
+run_tournament(matches, "results_testingagents.jsonl")
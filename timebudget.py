@@ -0,0 +1,104 @@
+import time
+
+#order and share of a turn spent in each phase. later phases inherit whatever earlier ones leave
+PHASES = (('update', 0.2), ('sense', 0.1), ('search', 0.7))
+
+#shortest engine search worth asking for, and the longest we give a single board
+MIN_SEARCH_TIME = 0.01
+#a MultiPV search splits its time over every root move, so fewer boards get longer each
+MIN_MULTIPV_TIME = 0.05
+MAX_SEARCH_TIME = 2.0
+
+
+class TimeBudget:
+    """
+    Clock manager shared by the belief agents. The remaining clock is spread over the turns
+    we still expect to play, and each turn is split between belief update, sensing and
+    engine search. Phase deadlines are cumulative so time saved early is spent on search.
+    """
+
+    def __init__(self, expected_turns=50, min_turns_left=15, increment=5.0, reserve=5.0, max_fraction=0.25):
+        self.expected_turns = expected_turns
+        self.min_turns_left = min_turns_left
+        self.increment = increment
+        self.reserve = reserve
+        self.max_fraction = max_fraction
+        self.turns_played = 0
+        self.seconds_left = None
+        self.turn_start = self._now()
+        self.turn_budget = 0.0
+
+    def _now(self):
+        return time.monotonic()
+
+    def start_turn(self, seconds_left=None):
+        #called as the turn begins. handle_opponent_move_result gets no clock reading,
+        #so until choose_sense syncs the real one we assume the last reading plus increment
+        self.turn_start = self._now()
+        if seconds_left is None and self.seconds_left is not None:
+            seconds_left = self.seconds_left + self.increment
+        self._set_budget(seconds_left)
+
+    def sync(self, seconds_left):
+        #corrects the budget with the referee's clock, keeping the turn's start time
+        elapsed = self._now() - self.turn_start
+        self._set_budget(seconds_left + elapsed)
+
+    def _set_budget(self, seconds_left):
+        if seconds_left is None:
+            self.turn_budget = 10.0
+            return
+        self.seconds_left = seconds_left
+        usable = max(0.0, seconds_left - self.reserve)
+        turns_left = max(self.min_turns_left, self.expected_turns - self.turns_played)
+        self.turn_budget = min(usable / turns_left + self.increment, usable * self.max_fraction)
+
+    def end_turn(self):
+        self.turns_played += 1
+        if self.seconds_left is not None:
+            self.seconds_left -= self._now() - self.turn_start
+
+    def _phase_end(self, phase):
+        share = 0.0
+        for name, fraction in PHASES:
+            share += fraction
+            if name == phase:
+                break
+        return self.turn_start + self.turn_budget * share
+
+    def deadline(self, phase):
+        #time.monotonic() at which the phase's share of the turn runs out
+        return self._phase_end(phase)
+
+    def remaining(self, phase):
+        return max(0.0, self._phase_end(phase) - self._now())
+
+    def expired(self, phase):
+        return self._now() >= self._phase_end(phase)
+
+    def affordable(self, phase, seconds_per_item):
+        #how many items of a known unit cost fit in what is left of the phase
+        return int(self.remaining(phase) / max(seconds_per_item, 1e-9))
+
+    def allocate(self, weights, phase='search', workers=1):
+        #engine seconds for each board, proportional to its weight. `workers` engines run
+        #side by side so the wall clock left is multiplied by the pool size
+        total = float(sum(weights))
+        if total <= 0:
+            return [MIN_SEARCH_TIME] * len(weights)
+        available = self.remaining(phase) * workers
+        return [min(MAX_SEARCH_TIME, max(MIN_SEARCH_TIME, available * w / total)) for w in weights]
+
+
+class FixedClock(TimeBudget):
+    """
+    TimeBudget for replays. Time stands still within a turn, so every budget follows from the
+    clock the referee reports and the turns played, never from how fast the machine runs, and
+    no phase has a deadline. The bot does all the work its budget allows, however long it takes.
+    """
+
+    def _now(self):
+        return 0.0
+
+    def deadline(self, phase):
+        return None
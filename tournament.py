@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import chess
+from reconchess import load_player, play_local_game, LocalGame
+
+#a match subprocess prints its result on a line starting with this, bots may print anything else
+RESULT_PREFIX = 'RESULT '
+
+BOTS = [
+    "ImprovedAgent.py",
+    "RandomSensing.py",
+    "TroutBot.py",
+    "RandomAgent.py"
+]
+
+#pairings we never play
+SKIP = [{"RandomAgent.py", "TroutBot.py"}]
+
+
+def double_round_robin(bots, repeats=2, skip=SKIP):
+    #every pair plays `repeats` rounds, each round once with each colour. ids are stable
+    #so an interrupted tournament can be resumed from its results file
+    matches = []
+    for i in range(len(bots)):
+        for j in range(i + 1, len(bots)):
+            bot1, bot2 = bots[i], bots[j]
+            if {bot1, bot2} in skip:
+                continue
+            for repeat in range(repeats):
+                for white, black in ((bot1, bot2), (bot2, bot1)):
+                    match_id = f"{white}|{black}|{repeat}"
+                    matches.append({"id": match_id, "white": white, "black": black})
+    return matches
+
+
+def clock_used(game, history, color):
+    #seconds of clock spent by `color`, counting the increments it was given
+    turns = history.num_turns(color) if history is not None else 0
+    return game.seconds_per_player + game.seconds_increment * turns - game.seconds_left_by_color[color]
+
+
+def play_match(white, black, seconds_per_player=900, history_dir=None):
+    #plays one game in this process and returns its result record
+    start = time.monotonic()
+    white_name, white_cls = load_player(white)
+    black_name, black_cls = load_player(black)
+    game = LocalGame(seconds_per_player)
+    try:
+        winner_color, win_reason, history = play_local_game(white_cls(), black_cls(), game=game)
+        winner = 'draw' if winner_color is None else chess.COLOR_NAMES[winner_color]
+        reason = win_reason.name if win_reason is not None else None
+    except Exception:
+        traceback.print_exc()
+        game.end()
+        history = game.get_game_history()
+        winner, reason = 'error', traceback.format_exc(limit=1).strip().splitlines()[-1]
+
+    record = {
+        "white": white,
+        "black": black,
+        "winner": winner,
+        "reason": reason,
+        "duration": round(time.monotonic() - start, 3),
+        "white_clock_used": round(clock_used(game, history, chess.WHITE), 3),
+        "black_clock_used": round(clock_used(game, history, chess.BLACK), 3),
+        "turns": history.num_turns() if history is not None else 0,
+    }
+    if history_dir and history is not None:
+        os.makedirs(history_dir, exist_ok=True)
+        path = os.path.join(history_dir, f"{white_name}-{black_name}-{int(time.time() * 1000)}.json")
+        history.save(path)
+        record["history"] = path
+    return record
+
+
+def run_match_subprocess(match, seconds_per_player, history_dir, engines_per_match):
+    #each match gets a fresh interpreter, as rc_bot_match does
+    cmd = [sys.executable, os.path.abspath(__file__), "--play", match["white"], match["black"],
+           "--seconds-per-player", str(seconds_per_player)]
+    if history_dir:
+        cmd += ["--history-dir", history_dir]
+    env = dict(os.environ, RBC_ENGINE_POOL_SIZE=str(engines_per_match))
+    start = time.monotonic()
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            record = json.loads(line[len(RESULT_PREFIX):])
+            break
+    else:
+        error = (proc.stderr.strip().splitlines() or ["no result"])[-1]
+        record = {"white": match["white"], "black": match["black"], "winner": "error", "reason": error,
+                  "duration": round(time.monotonic() - start, 3)}
+    record["id"] = match["id"]
+    return record
+
+
+def finished_ids(results_path, retry_errors=True):
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                #a half written last line from an interrupted run
+                continue
+            if retry_errors and record.get("winner") == "error":
+                continue
+            done.add(record["id"])
+    return done
+
+
+def shared_engines(address, engines=None):
+    #starts the engine service at `address` unless one is running, and points every bot
+    #started from now on at it. returns the service process to stop, or None
+    if not address:
+        return None
+    from engineservice import start_service, SERVICE_ENV
+    proc = start_service(address, engines or os.cpu_count() or 1)
+    os.environ[SERVICE_ENV] = address
+    return proc
+
+
+def run_tournament(matches, results_path="results.jsonl", workers=None, seconds_per_player=900,
+                   history_dir=None, engines_per_match=1, retry_errors=True, engine_service=None):
+    #plays every match not already in results_path, `workers` at a time, appending one
+    #JSON line per finished match so a killed run loses at most the games in flight.
+    #with engine_service (a unix socket path) every bot shares one warm engine pool
+    done = finished_ids(results_path, retry_errors)
+    pending = [m for m in matches if m["id"] not in done]
+    workers = workers or os.cpu_count() or 1
+    print(f"{len(matches) - len(pending)} of {len(matches)} matches already played, {len(pending)} to go")
+
+    service = shared_engines(engine_service)
+    try:
+        with open(results_path, "a") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_match_subprocess, m, seconds_per_player, history_dir, engines_per_match)
+                       for m in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                print(f"{record['white']} (White) vs {record['black']} (Black): {record['winner']} ({record['reason']})")
+    finally:
+        if service is not None:
+            from engineservice import stop_service
+            stop_service(service)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("bots", nargs="*", default=BOTS, help="bot source files or modules")
+    parser.add_argument("--results", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="matches played at once")
+    parser.add_argument("--repeats", type=int, default=2, help="rounds per pairing, each with both colours")
+    parser.add_argument("--seconds-per-player", type=float, default=900)
+    parser.add_argument("--engines-per-match", type=int, default=1, help="stockfish processes per bot")
+    parser.add_argument("--history-dir", default=None, help="save each game's history here")
+    parser.add_argument("--no-retry-errors", action="store_true", help="do not replay matches that errored")
+    parser.add_argument("--engine-service", metavar="SOCKET", default=None,
+                        help="share one engine service at this unix socket, started if not running")
+    parser.add_argument("--play", nargs=2, metavar=("WHITE", "BLACK"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.play:
+        record = play_match(args.play[0], args.play[1], args.seconds_per_player, args.history_dir)
+        print(RESULT_PREFIX + json.dumps(record))
+        return
+
+    run_tournament(double_round_robin(args.bots, args.repeats), args.results, args.workers,
+                   args.seconds_per_player, args.history_dir, args.engines_per_match,
+                   not args.no_retry_errors, args.engine_service)
+
+
+if __name__ == "__main__":
+    main()